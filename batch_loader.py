@@ -0,0 +1,189 @@
+"""
+"""
+import multiprocessing
+import os
+import traceback
+import numpy as np
+
+import stage_timer
+from srt_features import SrtFeatures
+from wav_features import WavFeatures
+
+
+def load_sample(params, data_dir, name):
+    """
+    load wav features and srt labels of data_dir/name.{wav,srt}.
+
+    return:
+        wav features, shape: [frame_size, cepstrum_size]
+        srt features, shape: [frame_size]
+    """
+    wav_window_size = params.get_wav_window_size()
+    wav_window_step = params.get_wav_window_step()
+    wav_sample_rate = params.get_wav_sample_rate()
+
+    wav_window_size_second = float(wav_window_size) / float(wav_sample_rate)
+    wav_window_step_second = float(wav_window_step) / float(wav_sample_rate)
+
+    data_wav_path = os.path.join(data_dir, name + '.wav')
+    data_srt_path = os.path.join(data_dir, name + '.srt')
+
+    sample_wav = WavFeatures()
+    sample_srt = SrtFeatures()
+
+    sample_wav.load(
+        data_wav_path,
+        window_size=wav_window_size_second,
+        window_step=wav_window_step_second,
+        numcep=params.get_wav_cepstrum_size(),
+        cache_dir=params.get_wav_feature_cache_path())
+
+    wav_features = sample_wav.features()
+
+    with stage_timer.stage('labels'):
+        sample_srt.load(data_srt_path, wav_sample_rate)
+
+        srt_features = sample_srt.features(
+            0, len(wav_features), wav_window_size, wav_window_step)
+
+    return wav_features, srt_features
+
+
+def load_batch(params, data_dir, names, rng):
+    """
+    randomly pick batch_size files which are longer than a sequence from
+    names and load them.
+
+    rng: np.random.RandomState, the only source of randomness.
+
+    return:
+        wav_batch, srt_batch
+    """
+    sequence_size = params.get_rnn_sequence_length()
+
+    wav_batch = []
+    srt_batch = []
+
+    for i in xrange(params.get_batch_size()):
+        while True:
+            with stage_timer.stage('select'):
+                wav_index = rng.randint(0, len(names))
+
+                name, _ = os.path.splitext(names[wav_index])
+
+            wav_features, srt_features = load_sample(params, data_dir, name)
+
+            if len(wav_features) > sequence_size:
+                break
+
+        wav_batch.append(wav_features)
+        srt_batch.append(srt_features)
+
+    return wav_batch, srt_batch
+
+
+class BatchLoader(object):
+    """
+    build batches in background processes.
+
+    batch i is always built by worker (i % worker_count) with a random state
+    seeded by (seed, i) and batches are consumed in order, so the sequence of
+    batches depends only on the seed, not on worker count or timing.
+
+    stage timings of a worker are sent with each batch and merged into the
+    stage timer of the consumer.
+    """
+    def __init__(self, make_batch, worker_count=0, queue_depth=4, seed=None):
+        """
+        make_batch:
+            a callable which takes a np.random.RandomState and returns a
+            batch. it's called in forked workers.
+        worker_count:
+            number of worker processes. build batches in the caller's process
+            if it's 0.
+        queue_depth:
+            max number of built batches waiting in each worker's queue.
+        seed:
+            random seed of the batch sequence. a random one if it's None.
+        """
+        if seed is None:
+            seed = np.random.randint(0, 2 ** 31 - 1)
+
+        self._make_batch = make_batch
+        self._worker_count = worker_count
+        self._queue_depth = max(1, queue_depth)
+        self._seed = seed
+        self._index = 0
+        self._queues = []
+        self._workers = []
+
+    def make_random_state(self, index):
+        """
+        """
+        return np.random.RandomState([self._seed, index])
+
+    def work(self, queue, worker_index):
+        """
+        worker process body.
+        """
+        index = worker_index
+
+        while True:
+            try:
+                batch = self._make_batch(self.make_random_state(index))
+            except Exception:
+                queue.put((None, traceback.format_exc(), {}))
+                return
+
+            queue.put((batch, None, stage_timer.TIMER.pop()))
+
+            index += self._worker_count
+
+    def start(self):
+        """
+        fork workers. should be called before any tensorflow session is
+        created.
+        """
+        for worker_index in xrange(self._worker_count):
+            queue = multiprocessing.Queue(self._queue_depth)
+
+            worker = multiprocessing.Process(
+                target=self.work, args=(queue, worker_index))
+
+            worker.daemon = True
+            worker.start()
+
+            self._queues.append(queue)
+            self._workers.append(worker)
+
+    def next_batch(self):
+        """
+        return the next batch in sequence.
+        """
+        index, self._index = self._index, self._index + 1
+
+        if self._worker_count == 0:
+            return self._make_batch(self.make_random_state(index))
+
+        with stage_timer.stage('wait'):
+            batch, error, timings = \
+                self._queues[index % self._worker_count].get()
+
+        stage_timer.TIMER.merge(timings)
+
+        if error is not None:
+            raise Exception('batch worker failed:\n{}'.format(error))
+
+        return batch
+
+    def close(self):
+        """
+        """
+        for worker in self._workers:
+            worker.terminate()
+
+        for worker in self._workers:
+            worker.join()
+
+        self._queues = []
+        self._workers = []
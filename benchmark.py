@@ -0,0 +1,375 @@
+"""
+throughput of every stage of the pipeline on synthetic data.
+
+usage:
+    python benchmark.py <param file>
+
+a movie of benchmark_seconds seconds (with cues), background sounds and
+voices are generated in a temporary directory, then each stage is timed
+benchmark_repeat times and the best run is reported. the result is printed
+as one json object:
+
+    {"stages": {"wav_load": {"seconds": ..., "frames": ...,
+                             "frames_per_second": ...,
+                             "realtime_factor": ...}, ...}, ...}
+
+realtime_factor is processing time over audio time, lower is faster. a
+stage which can not run here (e.g. no tensorflow) reports {"error": ...}.
+
+checkpoints, tensorboard logs and caches of the run are in the temporary
+directory too, no dataset is needed and nothing of the session is touched.
+"""
+import contextlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+import numpy as np
+import scipy.io.wavfile as wav
+
+import detect
+import speak
+from corpus import Corpus
+from parameters import Parameters
+from srt_features import SrtFeatures, SrtWriter
+from wav_features import WavFeatures
+
+
+@contextlib.contextmanager
+def quiet():
+    """
+    progress prints of the stages go to stderr, stdout is for the result.
+    """
+    stdout, sys.stdout = sys.stdout, sys.stderr
+
+    try:
+        yield
+    finally:
+        sys.stdout = stdout
+
+
+def make_voice(rng, sample_rate, size):
+    """
+    a tone with harmonics and a random pitch, enveloped like a syllable.
+    """
+    t = np.arange(size, dtype=np.float32) / sample_rate
+
+    pitch = rng.uniform(100.0, 300.0)
+
+    voice = sum(np.sin(2.0 * np.pi * k * pitch * t) / k for k in xrange(1, 4))
+
+    return (voice * np.hanning(size)).astype(np.float32)
+
+
+def make_fixtures(params, root_dir, seconds, rng):
+    """
+    write movie.wav/movie.srt, bground/bgm.wav and voice/*.wav under
+    root_dir.
+    """
+    sample_rate = params.get_wav_sample_rate()
+
+    movie = 0.05 * rng.randn(seconds * sample_rate).astype(np.float32)
+
+    voice_dir = os.path.join(root_dir, 'voice')
+    bground_dir = os.path.join(root_dir, 'bground')
+
+    for path in [voice_dir, bground_dir]:
+        Parameters.make_dir(path)
+
+    wav.write(os.path.join(bground_dir, 'bgm.wav'), sample_rate, movie)
+
+    for idx in xrange(32):
+        size = rng.randint(sample_rate / 2, 2 * sample_rate)
+
+        wav.write(os.path.join(voice_dir, '{}.wav'.format(idx)), sample_rate,
+                  make_voice(rng, sample_rate, size))
+
+    # a voice every 1 to 4 seconds
+    cues = []
+    index = rng.randint(0, sample_rate)
+
+    while True:
+        size = rng.randint(sample_rate / 2, 2 * sample_rate)
+
+        if index + size >= len(movie):
+            break
+
+        movie[index:index + size] += make_voice(rng, sample_rate, size)
+
+        cues.append((index, index + size))
+
+        index += size + rng.randint(sample_rate, 4 * sample_rate)
+
+    wav.write(os.path.join(root_dir, 'movie.wav'), sample_rate, movie)
+
+    with open(os.path.join(root_dir, 'movie.srt'), 'w') as srt:
+        for idx, (head, tail) in enumerate(cues):
+            srt.write("{}\n{} --> {}\n!@#$%^\n\n".format(
+                idx, speak.make_timestamp(head, sample_rate),
+                speak.make_timestamp(tail, sample_rate)))
+
+    return len(movie)
+
+
+class Benchmark(object):
+    """
+    """
+    def __init__(self, params, root_dir, sample_size, repeat):
+        """
+        """
+        self._params = params
+        self._root_dir = root_dir
+        self._repeat = repeat
+
+        self._sample_rate = params.get_wav_sample_rate()
+        self._window_size = params.get_wav_window_size()
+        self._window_step = params.get_wav_window_step()
+
+        self._wav_path = os.path.join(root_dir, 'movie.wav')
+        self._srt_path = os.path.join(root_dir, 'movie.srt')
+
+        self._audio_seconds = float(sample_size) / self._sample_rate
+        # same framing as mfcc, the last partial frame is padded
+        if sample_size <= self._window_size:
+            self._frame_size = 1
+        else:
+            self._frame_size = 1 + -(-(sample_size - self._window_size) //
+                                     self._window_step)
+
+        self._results = {}
+
+    def run(self, name, stage, frames=None, seconds=None):
+        """
+        time stage() repeat times and keep the best run.
+
+        frames/seconds: frames and audio seconds one call processes, the
+        whole movie if None.
+        """
+        frames = self._frame_size if frames is None else frames
+        seconds = self._audio_seconds if seconds is None else seconds
+
+        try:
+            timings = []
+
+            for _ in xrange(self._repeat):
+                begin = time.time()
+
+                with quiet():
+                    stage()
+
+                timings.append(time.time() - begin)
+        except Exception as e:
+            traceback.print_exc()
+
+            self._results[name] = {'error': str(e)}
+
+            return
+
+        best = min(timings)
+
+        self._results[name] = {
+            'seconds': best,
+            'frames': frames,
+            'frames_per_second': frames / best if best > 0 else None,
+            'realtime_factor': best / seconds,
+        }
+
+    def bench_srt(self):
+        """
+        SrtFeatures.load (srt parsing), SrtFeatures.features (labels) and
+        SrtWriter.save.
+        """
+        def load():
+            SrtFeatures().load(self._srt_path, self._sample_rate)
+
+        self.run('srt_load', load)
+
+        sample_srt = SrtFeatures()
+        sample_srt.load(self._srt_path, self._sample_rate)
+
+        def features():
+            # labels are cached per file, measure the computation
+            SrtFeatures._labels_cache.clear()
+
+            sample_srt.features(
+                0, self._frame_size, self._window_size, self._window_step)
+
+        self.run('srt_features', features)
+
+        masks = sample_srt.features(
+            0, self._frame_size, self._window_size, self._window_step)
+
+        target_srt = os.path.join(self._root_dir, 'save.srt')
+
+        def save():
+            SrtWriter.save(target_srt, masks, self._sample_rate,
+                           self._window_step,
+                           self._params.get_srt_min_segment_size(),
+                           self._params.get_srt_min_gap_size())
+
+        self.run('srt_save', save)
+
+    def bench_wav(self):
+        """
+        WavFeatures.load without cache, i.e. wav reading and mfcc.
+        """
+        def load():
+            WavFeatures().load(
+                self._wav_path,
+                window_size=float(self._window_size) / self._sample_rate,
+                window_step=float(self._window_step) / self._sample_rate,
+                numcep=self._params.get_wav_cepstrum_size())
+
+        self.run('wav_load', load)
+
+    def bench_mix(self):
+        """
+        speak.mix_track on one background track.
+        """
+        movie_dir = os.path.join(self._root_dir, 'mixed')
+        voice_dir = os.path.join(self._root_dir, 'voice')
+
+        Parameters.make_dir(movie_dir)
+
+        job = (self._sample_rate, 0, os.path.join(self._root_dir, 'bground'),
+               voice_dir, movie_dir, 'bgm.wav', sorted(os.listdir(voice_dir)))
+
+        self.run('mix_track', lambda: speak.mix_track(job))
+
+    def bench_train(self):
+        """
+        one VadModel.work('train') step: a batch of one sequence per movie
+        window.
+        """
+        from model import VadModel
+
+        params = self._params
+
+        wav_features = WavFeatures()
+        wav_features.load(
+            self._wav_path,
+            window_size=float(self._window_size) / self._sample_rate,
+            window_step=float(self._window_step) / self._sample_rate,
+            numcep=params.get_wav_cepstrum_size())
+
+        sample_srt = SrtFeatures()
+        sample_srt.load(self._srt_path, self._sample_rate)
+
+        wav_features = wav_features.features()
+        srt_features = sample_srt.features(
+            0, len(wav_features), self._window_size, self._window_step)
+
+        corpus = Corpus(wav_features, srt_features, [0, len(wav_features)])
+
+        batch_size = params.get_batch_size()
+        sequence_size = params.get_rnn_sequence_length()
+
+        wav_batch, srt_batch = corpus.sample(
+            np.random.RandomState(0), batch_size, sequence_size)
+
+        model = VadModel(params)
+
+        # the first run initializes lazily, don't count it
+        model.train(wav_batch, srt_batch)
+
+        frames = batch_size * sequence_size
+
+        self.run('train_step', lambda: model.train(wav_batch, srt_batch),
+                 frames=frames,
+                 seconds=float(frames * self._window_step) / self._sample_rate)
+
+        import tensorflow as tf
+
+        tf.reset_default_graph()
+
+    def reset_detect_model(self):
+        """
+        each tensorflow engine build adds a model to the default graph.
+        """
+        if not self._params.should_use_numpy_engine():
+            import tensorflow as tf
+
+            tf.reset_default_graph()
+
+    def bench_detect(self):
+        """
+        detect.py end to end: build the engine (graph and checkpoint restore
+        with tensorflow) then detect.detect_files.
+        """
+        params = self._params
+
+        def detect_end_to_end():
+            self.reset_detect_model()
+
+            detect.detect_files(
+                params, detect.build_model(params), [self._wav_path])
+
+        self.run('detect', detect_end_to_end)
+
+    def bench_detect_files(self):
+        """
+        detect.detect_files with a built engine: features, model and srt.
+        """
+        self.reset_detect_model()
+
+        model = detect.build_model(self._params)
+
+        self.run('detect_files', lambda: detect.detect_files(
+            self._params, model, [self._wav_path]))
+
+    def results(self):
+        """
+        """
+        return self._results
+
+
+if __name__ == "__main__":
+    """
+    """
+    root_dir = tempfile.mkdtemp(prefix='vad_benchmark_')
+
+    try:
+        # checkpoints and logs of the benchmark model go to root_dir
+        params = Parameters(root_dir=root_dir, need_datasets=False)
+
+        seconds = params.get_benchmark_seconds()
+        repeat = params.get_benchmark_repeat()
+
+        fixture_dir = os.path.join(root_dir, 'fixtures')
+
+        Parameters.make_dir(fixture_dir)
+
+        sample_size = make_fixtures(
+            params, fixture_dir, seconds, np.random.RandomState(0))
+
+        benchmark = Benchmark(params, fixture_dir, sample_size, repeat)
+
+        # setup failures are reported under the name of the stage
+        benches = [
+            ('srt_load', benchmark.bench_srt),
+            ('wav_load', benchmark.bench_wav),
+            ('mix_track', benchmark.bench_mix),
+            ('train_step', benchmark.bench_train),
+            ('detect', benchmark.bench_detect),
+            ('detect_files', benchmark.bench_detect_files),
+        ]
+
+        for name, bench in benches:
+            try:
+                bench()
+            except Exception as e:
+                traceback.print_exc()
+
+                benchmark.results()[name] = {'error': str(e)}
+    finally:
+        shutil.rmtree(root_dir)
+
+    print json.dumps({
+        'session_name': params.get_session_name(),
+        'audio_seconds': seconds,
+        'repeat': repeat,
+        'stages': benchmark.results(),
+    }, indent=2, sort_keys=True)
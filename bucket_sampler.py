@@ -0,0 +1,104 @@
+"""
+"""
+import os
+import numpy as np
+import scipy.io.wavfile as wav
+
+import stage_timer
+from batch_loader import load_sample
+
+
+def frame_count(path, window_size, window_step):
+    """
+    number of feature frames of a wav, from its header. same as the framing
+    of python_speech_features.
+
+    window_size, window_step: in samples.
+    """
+    _, samples = wav.read(path, mmap=True)
+
+    sample_size = len(samples)
+
+    if sample_size <= window_size:
+        return 1
+
+    return 1 + -(-(sample_size - window_size) // window_step)
+
+
+class BucketSampler(object):
+    """
+    files of similar lengths are grouped into buckets and each batch is drawn
+    from a single bucket, so reshape_data truncates less of each batch.
+    every file is as likely to be drawn as with load_batch.
+    """
+    def __init__(self, params, data_dir, names):
+        """
+        """
+        self._params = params
+        self._data_dir = data_dir
+        self._batch_size = params.get_batch_size()
+
+        sequence_size = params.get_rnn_sequence_length()
+        window_size = params.get_wav_window_size()
+        window_step = params.get_wav_window_step()
+
+        names = [os.path.splitext(name)[0] for name in sorted(names)]
+
+        sizes = np.array([
+            frame_count(os.path.join(data_dir, name + '.wav'), window_size,
+                        window_step) for name in names], dtype=np.int64)
+
+        # same as load_batch, files must be longer than a sequence
+        valid = sizes > sequence_size
+
+        if not np.any(valid):
+            raise Exception('need files longer than {} frames in {}'.format(
+                sequence_size, data_dir))
+
+        self._names = [name for name, v in zip(names, valid) if v]
+        self._sizes = sizes[valid]
+
+        # equal sized buckets of files sorted by length
+        order = np.argsort(self._sizes, kind='mergesort')
+
+        bucket_count = max(1, min(
+            params.get_bucket_count(), len(order) / self._batch_size))
+
+        self._buckets = np.array_split(order, bucket_count)
+
+        # draw buckets by their number of files, so every file is equally
+        # likely
+        self._bucket_weights = np.array(
+            [len(bucket) for bucket in self._buckets], dtype=np.float64)
+        self._bucket_weights /= self._bucket_weights.sum()
+
+    def bucket_sizes(self):
+        """
+        [(min frames, max frames, file count), ...] of the buckets.
+        """
+        return [(int(self._sizes[bucket].min()),
+                 int(self._sizes[bucket].max()),
+                 len(bucket)) for bucket in self._buckets]
+
+    def make_batch(self, rng):
+        """
+        return:
+            wav_batch, srt_batch
+        """
+        with stage_timer.stage('select'):
+            bucket = self._buckets[
+                rng.choice(len(self._buckets), p=self._bucket_weights)]
+
+            picks = bucket[rng.randint(0, len(bucket), self._batch_size)]
+
+        wav_batch = []
+        srt_batch = []
+
+        for idx in picks:
+            wav_features, srt_features = load_sample(
+                self._params, self._data_dir, self._names[idx])
+
+            wav_batch.append(wav_features)
+            srt_batch.append(srt_features)
+
+        return wav_batch, srt_batch
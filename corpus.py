@@ -0,0 +1,95 @@
+"""
+"""
+import os
+import numpy as np
+
+from batch_loader import load_sample
+
+
+class Corpus(object):
+    """
+    features and labels of all files of a split in two contiguous arrays,
+    with an offsets index. batches are fixed length windows gathered from
+    them, so no frame is truncated and building a batch is a single fancy
+    index.
+    """
+    def __init__(self, wav, srt, offsets):
+        """
+        wav:
+            features of all files.
+            shape: [total_frame_size, cepstrum_size]
+        srt:
+            labels of all files.
+            shape: [total_frame_size]
+        offsets:
+            file i spans wav[offsets[i]:offsets[i + 1]].
+            shape: [file_count + 1]
+        """
+        self._wav = wav
+        self._srt = srt
+        self._offsets = np.asarray(offsets, dtype=np.int64)
+
+    @staticmethod
+    def load(params, data_dir, names):
+        """
+        load all files of names under data_dir into memory.
+        """
+        wav_list = []
+        srt_list = []
+        offsets = [0]
+
+        for name in names:
+            name, _ = os.path.splitext(name)
+
+            wav_features, srt_features = load_sample(params, data_dir, name)
+
+            wav_list.append(wav_features.astype(np.float32))
+            srt_list.append(srt_features.astype(np.int8))
+            offsets.append(offsets[-1] + len(wav_features))
+
+        if len(wav_list) == 0:
+            raise Exception('need files in {}'.format(data_dir))
+
+        return Corpus(np.vstack(wav_list), np.hstack(srt_list), offsets)
+
+    def file_count(self):
+        """
+        """
+        return len(self._offsets) - 1
+
+    def frame_size(self):
+        """
+        """
+        return int(self._offsets[-1])
+
+    def sample(self, rng, batch_size, window_size):
+        """
+        draw batch_size windows of window_size frames. every window which
+        lies inside a single file is equally likely.
+
+        rng: np.random.RandomState
+
+        return:
+            wav_batch, shape: [batch_size, window_size, cepstrum_size]
+            srt_batch, shape: [batch_size, window_size]
+        """
+        lengths = np.diff(self._offsets)
+
+        # number of windows each file can provide
+        counts = np.maximum(lengths - window_size + 1, 0)
+
+        total = counts.sum()
+
+        if total == 0:
+            raise Exception('need files longer than {}'.format(window_size))
+
+        # pick windows uniformly over all valid windows, then locate files
+        picks = rng.randint(0, total, batch_size)
+
+        bounds = np.cumsum(counts)
+        files = np.searchsorted(bounds, picks, side='right')
+        heads = self._offsets[files] + picks - (bounds[files] - counts[files])
+
+        indices = heads[:, None] + np.arange(window_size)[None, :]
+
+        return self._wav[indices], self._srt[indices]
@@ -1,41 +1,126 @@
 """
+usage:
+    python detect.py <param file> <movie wav or directory> ...
+
+write one srt next to each wav.
 """
 import os
 
-from model import VadModel
 from parameters import Parameters
-from srt_features import SrtWriter
+from srt_features import SrtStreamWriter, SrtWriter
 from wav_features import WavFeatures
 
 
-params = Parameters()
+def build_model(params):
+    """
+    build the detection engine. tensorflow is imported only if it's used.
+    """
+    if params.should_use_numpy_engine():
+        from numpy_model import NumpyVadModel
+
+        return NumpyVadModel(params)
+
+    from model import VadModel
+
+    return VadModel(params, inference=True)
+
+
+def target_srt_path(source_wav):
+    """
+    """
+    return os.path.splitext(source_wav)[0] + '.srt'
+
+
+def detect_files(params, model, source_wavs):
+    """
+    detect movies in batches and write one srt per movie. movies are sorted
+    by size so each batch packs movies of similar lengths.
+    """
+    wav_window_size = params.get_wav_window_size()
+    wav_window_step = params.get_wav_window_step()
+    wav_sample_rate = params.get_wav_sample_rate()
+
+    wav_window_size_second = float(wav_window_size) / float(wav_sample_rate)
+    wav_window_step_second = float(wav_window_step) / float(wav_sample_rate)
+
+    batch_size = params.get_detect_batch_size()
+
+    source_wavs = sorted(source_wavs, key=os.path.getsize)
+
+    for base in xrange(0, len(source_wavs), batch_size):
+        batch_paths = source_wavs[base:base+batch_size]
+
+        wav_batch = []
+
+        for source_wav in batch_paths:
+            input_wav = WavFeatures()
+
+            input_wav.load(
+                source_wav,
+                window_size=wav_window_size_second,
+                window_step=wav_window_step_second,
+                numcep=params.get_wav_cepstrum_size())
+
+            wav_batch.append(input_wav.features())
+
+        features = model.detect_batch(wav_batch)
+
+        for source_wav, feature in zip(batch_paths, features):
+            SrtWriter.save(target_srt_path(source_wav), feature,
+                           wav_sample_rate, wav_window_step,
+                           params.get_srt_min_segment_size(),
+                           params.get_srt_min_gap_size())
+
+            print 'detected {}'.format(source_wav)
+
+
+def detect_stream(params, model, source_wav, target_srt):
+    """
+    read, featurize and detect the wav block by block. cues are written as
+    soon as they are closed. memory does not grow with the wav length.
+    """
+    wav_window_size = params.get_wav_window_size()
+    wav_window_step = params.get_wav_window_step()
+    wav_sample_rate = params.get_wav_sample_rate()
+
+    wav_window_size_second = float(wav_window_size) / float(wav_sample_rate)
+    wav_window_step_second = float(wav_window_step) / float(wav_sample_rate)
 
-source_wav = params.get_movie_path()
-target_srt = os.path.splitext(source_wav)[0] + '.srt'
+    input_wav = WavFeatures()
 
-batch_size = 1
-sequence_size = params.get_rnn_sequence_length()
-wav_window_size = params.get_wav_window_size()
-wav_window_step = params.get_wav_window_step()
-wav_sample_rate = params.get_wav_sample_rate()
+    blocks = input_wav.stream(
+        source_wav,
+        params.get_detect_block_size(),
+        window_size=wav_window_size_second,
+        window_step=wav_window_step_second,
+        numcep=params.get_wav_cepstrum_size())
 
-wav_window_size_second = float(wav_window_size) / float(wav_sample_rate)
-wav_window_step_second = float(wav_window_step) / float(wav_sample_rate)
+    writer = SrtStreamWriter(
+        target_srt, wav_sample_rate, wav_window_step,
+        params.get_srt_min_segment_size(), params.get_srt_min_gap_size())
 
-input_wav = WavFeatures()
+    try:
+        for features in model.detect_stream(blocks):
+            writer.write(features)
+    finally:
+        writer.close()
 
-input_wav.load(
-    source_wav,
-    window_size=wav_window_size_second,
-    window_step=wav_window_step_second,
-    numcep=params.get_wav_cepstrum_size())
 
-wav_features = input_wav.features()
+if __name__ == "__main__":
+    """
+    """
+    params = Parameters()
 
-wav_batch = [wav_features]
+    source_wavs = params.get_movie_paths()
 
-model = VadModel(params)
+    if len(source_wavs) == 0:
+        raise Exception('need movie files or directories')
 
-features = model.detect(wav_batch)
+    model = build_model(params)
 
-SrtWriter.save(target_srt, features[0], wav_sample_rate, wav_window_step)
+    if params.should_stream_detection():
+        for source_wav in source_wavs:
+            detect_stream(
+                params, model, source_wav, target_srt_path(source_wav))
+    else:
+        detect_files(params, model, source_wavs)
@@ -0,0 +1,429 @@
+"""
+a long running detection service. the model is built and restored once,
+jobs come in through a local unix socket.
+
+usage:
+    python detect_server.py <param file>
+
+protocol: one json object per line in both directions.
+
+    {"wav": "/path/movie.wav"}
+        detect and write /path/movie.srt, reply {"srt": "/path/movie.srt"}.
+    {"wav": "/path/movie.wav", "srt": "/path/other.srt"}
+        write to the specified srt.
+    {"wav": "/path/movie.wav", "cues": true}
+        reply {"cues": [["0:0:1,200", "0:0:3,40"], ...]} without writing.
+    {"stats": true}
+        reply latency metrics of the service.
+
+every reply of a job carries 'batch_size' (number of jobs detected in the
+same model call), 'queue_ms' and 'latency_ms'. failed jobs and invalid
+requests reply {"error": message}. if the dispatcher stops, all waiting and
+later jobs fail.
+
+concurrent jobs are micro-batched: the dispatcher takes the first job in the
+queue, waits up to detect_batch_wait_ms for more (at most detect_batch_size)
+and detects all of them in one VadModel.work('detect', ...) call per
+sequence.
+"""
+import collections
+import json
+import os
+import Queue
+import socket
+import SocketServer
+import threading
+import time
+import numpy as np
+
+from detect import build_model, target_srt_path
+from parameters import Parameters
+from srt_features import SrtWriter
+from wav_features import WavFeatures
+
+
+class DetectMetrics(object):
+    """
+    counters and recent latencies of the service.
+    """
+    def __init__(self, window=1000):
+        """
+        window: number of recent jobs kept for percentiles.
+        """
+        self._lock = threading.Lock()
+        self._job_count = 0
+        self._error_count = 0
+        self._batch_count = 0
+        self._queue_ms = collections.deque(maxlen=window)
+        self._latency_ms = collections.deque(maxlen=window)
+        self._batch_sizes = collections.deque(maxlen=window)
+
+    def add_batch(self, size):
+        """
+        """
+        with self._lock:
+            self._batch_count += 1
+            self._batch_sizes.append(size)
+
+    def add_job(self, queue_ms, latency_ms, failed):
+        """
+        """
+        with self._lock:
+            self._job_count += 1
+            self._error_count += 1 if failed else 0
+            self._queue_ms.append(queue_ms)
+            self._latency_ms.append(latency_ms)
+
+    def report(self):
+        """
+        """
+        def percentiles(values):
+            if len(values) == 0:
+                return {}
+
+            values = np.array(values)
+
+            return {
+                'p50': float(np.percentile(values, 50)),
+                'p90': float(np.percentile(values, 90)),
+                'p99': float(np.percentile(values, 99)),
+                'max': float(values.max()),
+            }
+
+        with self._lock:
+            return {
+                'jobs': self._job_count,
+                'errors': self._error_count,
+                'batches': self._batch_count,
+                'mean_batch_size': float(np.mean(self._batch_sizes))
+                if len(self._batch_sizes) > 0 else 0.0,
+                'queue_ms': percentiles(self._queue_ms),
+                'latency_ms': percentiles(self._latency_ms),
+            }
+
+
+class DetectJob(object):
+    """
+    a request waiting for its reply.
+    """
+    def __init__(self, request):
+        """
+        """
+        self._request = request
+        self._reply = None
+        self._time_queued = time.time()
+        self._time_started = None
+        self._done = threading.Event()
+
+    def finish(self, reply):
+        """
+        """
+        self._reply = reply
+        self._done.set()
+
+    def wait(self, timeout=None):
+        """
+        return the reply, None if it's not done within timeout seconds.
+        """
+        self._done.wait(timeout)
+
+        return self._reply
+
+
+class DetectDispatcher(object):
+    """
+    owns the model. takes jobs from the queue and detects them in batches in
+    a single thread.
+    """
+    def __init__(self, params, model, metrics):
+        """
+        """
+        self._params = params
+        self._model = model
+        self._metrics = metrics
+        self._jobs = Queue.Queue()
+        self._failure = None
+        self._batch_size = params.get_detect_batch_size()
+        self._batch_wait = params.get_detect_batch_wait_ms() / 1000.0
+
+        wav_window_size = params.get_wav_window_size()
+        wav_sample_rate = params.get_wav_sample_rate()
+
+        self._wav_window_step = params.get_wav_window_step()
+        self._srt_min_segment_size = params.get_srt_min_segment_size()
+        self._srt_min_gap_size = params.get_srt_min_gap_size()
+        self._wav_sample_rate = wav_sample_rate
+        self._wav_window_size_second = \
+            float(wav_window_size) / float(wav_sample_rate)
+        self._wav_window_step_second = \
+            float(self._wav_window_step) / float(wav_sample_rate)
+
+    def submit(self, request):
+        """
+        queue a request and block until it's done. return the reply. raise if
+        the dispatcher has stopped.
+        """
+        job = DetectJob(request)
+
+        self._jobs.put(job)
+
+        while True:
+            # the dispatcher may stop before it takes the job
+            reply = job.wait(1.0)
+
+            if reply is not None:
+                return reply
+
+            if self._failure is not None:
+                raise Exception(
+                    'detect dispatcher stopped: {}'.format(self._failure))
+
+    def next_batch(self):
+        """
+        block for one job, then gather more until the batch is full or the
+        wait window is over.
+        """
+        jobs = [self._jobs.get()]
+
+        deadline = time.time() + self._batch_wait
+
+        while len(jobs) < self._batch_size:
+            timeout = deadline - time.time()
+
+            if timeout <= 0:
+                break
+
+            try:
+                jobs.append(self._jobs.get(True, timeout))
+            except Queue.Empty:
+                break
+
+        return jobs
+
+    def load(self, job):
+        """
+        wav features of a job.
+        """
+        source_wav = job._request['wav']
+
+        if not os.path.isfile(source_wav):
+            raise Exception('invalid wav path: {}'.format(source_wav))
+
+        input_wav = WavFeatures()
+
+        input_wav.load(
+            source_wav,
+            window_size=self._wav_window_size_second,
+            window_step=self._wav_window_step_second,
+            numcep=self._params.get_wav_cepstrum_size())
+
+        return input_wav.features()
+
+    def reply(self, job, features):
+        """
+        """
+        request = job._request
+
+        if request.get('cues', False):
+            segments = SrtWriter.merge(
+                SrtWriter.segments(features), self._srt_min_segment_size,
+                self._srt_min_gap_size)
+
+            times = SrtWriter.timestamps(
+                segments.ravel(), self._wav_window_step, self._wav_sample_rate)
+
+            return {'cues': [times[i:i + 2] for i in xrange(0, len(times), 2)]}
+
+        target_srt = request.get('srt', target_srt_path(request['wav']))
+
+        SrtWriter.save(target_srt, features, self._wav_sample_rate,
+                       self._wav_window_step, self._srt_min_segment_size,
+                       self._srt_min_gap_size)
+
+        return {'srt': target_srt}
+
+    def finish(self, job, reply, batch_size):
+        """
+        """
+        time_finished = time.time()
+
+        queue_ms = 1000.0 * (job._time_started - job._time_queued)
+        latency_ms = 1000.0 * (time_finished - job._time_queued)
+
+        reply['batch_size'] = batch_size
+        reply['queue_ms'] = queue_ms
+        reply['latency_ms'] = latency_ms
+
+        self._metrics.add_job(queue_ms, latency_ms, 'error' in reply)
+
+        job.finish(reply)
+
+    def run(self):
+        """
+        dispatcher loop. if it fails, the failure is recorded for submit and
+        queued jobs are failed.
+        """
+        try:
+            self.dispatch()
+        except BaseException as e:
+            self._failure = repr(e)
+
+            while True:
+                try:
+                    job = self._jobs.get(False)
+                except Queue.Empty:
+                    break
+
+                job.finish({'error': 'detect dispatcher stopped: {}'.format(
+                    self._failure)})
+
+            raise
+
+    def dispatch(self):
+        """
+        """
+        while True:
+            jobs = self.next_batch()
+
+            time_started = time.time()
+
+            loaded_jobs = []
+            wav_batch = []
+
+            for job in jobs:
+                job._time_started = time_started
+
+                try:
+                    wav_batch.append(self.load(job))
+                    loaded_jobs.append(job)
+                except Exception as e:
+                    self.finish(job, {'error': str(e)}, len(jobs))
+
+            if len(loaded_jobs) == 0:
+                continue
+
+            self._metrics.add_batch(len(loaded_jobs))
+
+            try:
+                features = self._model.detect_batch(wav_batch)
+            except Exception as e:
+                for job in loaded_jobs:
+                    self.finish(job, {'error': str(e)}, len(loaded_jobs))
+                continue
+
+            for job, feature in zip(loaded_jobs, features):
+                try:
+                    reply = self.reply(job, feature)
+                except Exception as e:
+                    reply = {'error': str(e)}
+
+                self.finish(job, reply, len(loaded_jobs))
+
+
+class DetectRequestHandler(SocketServer.StreamRequestHandler):
+    """
+    one connection may send many requests, one json per line.
+    """
+    def handle(self):
+        """
+        """
+        for line in self.rfile:
+            line = line.strip()
+
+            if len(line) == 0:
+                continue
+
+            reply = self.reply(line)
+
+            self.wfile.write(json.dumps(reply) + '\n')
+            self.wfile.flush()
+
+    def reply(self, line):
+        """
+        reply of one request line, an error for anything but a json object.
+        """
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            return {'error': 'invalid request: {}'.format(e)}
+
+        if not isinstance(request, dict):
+            return {'error': 'invalid request: need a json object'}
+
+        if request.get('stats', False):
+            return self.server._metrics.report()
+
+        if 'wav' not in request:
+            return {'error': 'need wav path'}
+
+        try:
+            return self.server._dispatcher.submit(request)
+        except Exception as e:
+            return {'error': str(e)}
+
+
+class DetectServer(SocketServer.ThreadingMixIn,
+                   SocketServer.UnixStreamServer):
+    """
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path, dispatcher, metrics):
+        """
+        """
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+        SocketServer.UnixStreamServer.__init__(
+            self, socket_path, DetectRequestHandler)
+
+        self._dispatcher = dispatcher
+        self._metrics = metrics
+
+
+def request(socket_path, payload):
+    """
+    send one request to a running server and return its reply.
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try:
+        client.connect(socket_path)
+        client.sendall(json.dumps(payload) + '\n')
+
+        reply = client.makefile('r').readline()
+    finally:
+        client.close()
+
+    return json.loads(reply)
+
+
+if __name__ == "__main__":
+    """
+    """
+    params = Parameters()
+
+    model = build_model(params)
+
+    metrics = DetectMetrics()
+
+    dispatcher = DetectDispatcher(params, model, metrics)
+
+    worker = threading.Thread(target=dispatcher.run)
+    worker.daemon = True
+    worker.start()
+
+    socket_path = params.get_detect_socket_path()
+
+    server = DetectServer(socket_path, dispatcher, metrics)
+
+    print 'detecting on {}'.format(socket_path)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+        os.remove(socket_path)
@@ -0,0 +1,275 @@
+"""
+score a model on every file of the test and validate splits.
+
+usage:
+    python evaluate.py <param file>
+
+restore the latest checkpoint of the session and evaluate it. if
+evaluate_interval is not 0, keep running and evaluate each new checkpoint,
+checking every evaluate_interval seconds, so training never pauses for
+evaluation. results are printed, appended to evaluation.jsonl and written
+as summaries under the 'evaluate' dir of the session's tensorboard logs.
+
+metrics:
+    frame: accuracy, precision, recall and f1 of voice frames.
+    segment: a voice segment of the srt is found if any detected segment
+    overlaps it (recall), a detected segment is correct if it overlaps any
+    voice segment (precision).
+"""
+import json
+import multiprocessing
+import os
+import time
+import numpy as np
+
+from batch_loader import load_sample
+from parameters import Parameters
+from srt_features import SrtWriter
+
+
+def load_job(job):
+    """
+    job: (params, data_dir, name)
+    """
+    params, data_dir, name = job
+
+    return load_sample(params, data_dir, name)
+
+
+def load_split(params, data_dir, worker_count):
+    """
+    load features and labels of all files under data_dir in worker_count
+    processes. should be done before tensorflow starts its threads.
+    """
+    names = sorted(
+        os.path.splitext(name)[0] for name in os.listdir(data_dir)
+        if name.endswith('.wav'))
+
+    jobs = [(params, data_dir, name) for name in names]
+
+    if worker_count == 0:
+        return map(load_job, jobs)
+
+    pool = multiprocessing.Pool(worker_count)
+
+    try:
+        return pool.map(load_job, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def overlaps(segments, others):
+    """
+    for each [head, tail) segment, whether it overlaps any of others. both
+    are sorted and don't overlap each other, as SrtWriter.segments returns.
+    """
+    if len(segments) == 0 or len(others) == 0:
+        return np.zeros(len(segments), dtype=np.bool)
+
+    # first of others which ends after the head of each segment
+    indices = np.searchsorted(others[:, 1], segments[:, 0], side='right')
+
+    valid = indices < len(others)
+
+    result = np.zeros(len(segments), dtype=np.bool)
+
+    result[valid] = others[indices[valid], 0] < segments[valid, 1]
+
+    return result
+
+
+def ratio(a, b):
+    """
+    """
+    return float(a) / float(b) if b > 0 else 0.0
+
+
+class Evaluation(object):
+    """
+    counts of a split, updated file by file.
+    """
+    def __init__(self):
+        """
+        """
+        self._counts = {
+            'files': 0,
+            'frame_tp': 0,
+            'frame_fp': 0,
+            'frame_fn': 0,
+            'frame_tn': 0,
+            'target_segments': 0,
+            'found_segments': 0,
+            'result_segments': 0,
+            'correct_segments': 0,
+        }
+
+    def add(self, result, target):
+        """
+        result: detected masks of a file.
+        target: labels of the file.
+        """
+        size = min(len(result), len(target))
+
+        result = np.asarray(result[:size]) == 1
+        target = np.asarray(target[:size]) == 1
+
+        counts = self._counts
+
+        counts['files'] += 1
+        counts['frame_tp'] += int(np.sum(result & target))
+        counts['frame_fp'] += int(np.sum(result & ~target))
+        counts['frame_fn'] += int(np.sum(~result & target))
+        counts['frame_tn'] += int(np.sum(~result & ~target))
+
+        result_segments = SrtWriter.segments(result)
+        target_segments = SrtWriter.segments(target)
+
+        counts['target_segments'] += len(target_segments)
+        counts['found_segments'] += \
+            int(np.sum(overlaps(target_segments, result_segments)))
+        counts['result_segments'] += len(result_segments)
+        counts['correct_segments'] += \
+            int(np.sum(overlaps(result_segments, target_segments)))
+
+    def report(self):
+        """
+        """
+        counts = self._counts
+
+        tp, fp = counts['frame_tp'], counts['frame_fp']
+        fn, tn = counts['frame_fn'], counts['frame_tn']
+
+        precision = ratio(tp, tp + fp)
+        recall = ratio(tp, tp + fn)
+
+        segment_precision = \
+            ratio(counts['correct_segments'], counts['result_segments'])
+        segment_recall = \
+            ratio(counts['found_segments'], counts['target_segments'])
+
+        report = dict(counts)
+
+        report.update({
+            'accuracy': ratio(tp + tn, tp + fp + fn + tn),
+            'precision': precision,
+            'recall': recall,
+            'f1': ratio(2.0 * precision * recall, precision + recall),
+            'segment_precision': segment_precision,
+            'segment_recall': segment_recall,
+            'segment_f1': ratio(2.0 * segment_precision * segment_recall,
+                                segment_precision + segment_recall),
+        })
+
+        return report
+
+
+def evaluate(params, model, samples):
+    """
+    detect all samples with model.detect_batch, files of similar lengths in
+    the same batch, and score them.
+
+    samples: [(wav_features, srt_features), ...]
+    """
+    evaluation = Evaluation()
+
+    batch_size = params.get_detect_batch_size()
+
+    samples = sorted(samples, key=lambda sample: len(sample[0]))
+
+    for base in xrange(0, len(samples), batch_size):
+        batch = samples[base:base + batch_size]
+
+        results = model.detect_batch([wav for wav, _ in batch])
+
+        for result, (_, srt) in zip(results, batch):
+            evaluation.add(result, srt)
+
+    return evaluation.report()
+
+
+def load_splits(params):
+    """
+    {split name: samples} of the test and validate splits.
+    """
+    worker_count = params.get_evaluate_worker_count()
+
+    return {
+        'test': load_split(params, params.get_dir_cue_test(), worker_count),
+        'validate': load_split(
+            params, params.get_dir_cue_validate(), worker_count),
+    }
+
+
+def write_log(path, gstep, checkpoint_path, reports):
+    """
+    """
+    with open(path, 'a') as log:
+        log.write(json.dumps({
+            'time': time.time(),
+            'gstep': gstep,
+            'checkpoint': checkpoint_path,
+            'splits': reports,
+        }, sort_keys=True) + '\n')
+
+
+if __name__ == "__main__":
+    """
+    """
+    params = Parameters()
+
+    # fork feature workers before tensorflow starts its threads
+    splits = load_splits(params)
+
+    import tensorflow as tf
+
+    from model import VadModel
+
+    model = VadModel(params, inference=True)
+
+    reporter = tf.summary.FileWriter(
+        os.path.join(params.get_tensorboard_log_path(), 'evaluate'))
+
+    interval = params.get_evaluate_interval()
+
+    checkpoint_path = None
+
+    while True:
+        latest_path = tf.train.latest_checkpoint(
+            params.get_checkpoint_source_path())
+
+        if latest_path is None:
+            print 'no checkpoint in {}'.format(
+                params.get_checkpoint_source_path())
+        elif latest_path != checkpoint_path:
+            checkpoint_path = model.restore(latest_path)
+
+            gstep = model.global_step()
+
+            reports = {name: evaluate(params, model, samples)
+                       for name, samples in splits.items()}
+
+            write_log(params.get_evaluation_log_path(), gstep,
+                      checkpoint_path, reports)
+
+            values = []
+
+            for name in sorted(reports):
+                for key in ['accuracy', 'precision', 'recall', 'f1',
+                            'segment_precision', 'segment_recall',
+                            'segment_f1']:
+                    values.append(tf.Summary.Value(
+                        tag='{}/{}'.format(name, key),
+                        simple_value=reports[name][key]))
+
+                print 'step:{}, {} accuracy: {}, f1: {}, segment f1: {}' \
+                    .format(gstep, name, reports[name]['accuracy'],
+                            reports[name]['f1'], reports[name]['segment_f1'])
+
+            reporter.add_summary(tf.Summary(value=values), gstep)
+            reporter.flush()
+
+        if interval <= 0:
+            break
+
+        time.sleep(interval)
@@ -19,6 +19,12 @@ datasets +-+ cue +-+ sample_rate +-+ test     +-+ *.wav
 
 sample_rate can be any integer which is 4000 in the first version.
 
+training data progress is recorded in datasets/cue/sample_rate/training/
+manifest.sqlite: completed spans and fully extracted sources. a rerun only
+plans sources which are not done and only extracts their missing spans.
+outputs are written under temporary names and renamed when complete, so an
+interrupted run never leaves a half-written clip that looks done.
+
 training data:
     that prefix and first 8 characters of file hash would be served as prefix
     of its associated extracted data. e.g.
@@ -34,12 +40,24 @@ training data:
 test & validate data:
     data is only transformed. no extraction.
 
-usage: python extractor.py 4000
+usage: python extractor.py 4000 [worker_count] [--decode-once]
+
+worker_count is the number of ffmpeg processes to run in parallel. use all
+cores if it's omitted.
 
+--decode-once decodes each source mp3 once to a temporary float32 pcm file
+and writes all of its spans as slices of it, instead of running ffmpeg (which
+decodes from the head of the mp3) once per span.
 """
 import hashlib
+import multiprocessing
 import os
+import sqlite3
+import struct
 import sys
+import tempfile
+import numpy as np
+import scipy.io.wavfile as wav
 
 
 class SrtCue(object):
@@ -252,6 +270,17 @@ def prepare_params():
     if params['sample_rate'] < 1:
         raise Exception('need sample rate which is greater than 0')
 
+    params['worker_count'] = multiprocessing.cpu_count()
+    params['decode_once'] = False
+
+    for arg in sys.argv[2:]:
+        if arg == '--decode-once':
+            params['decode_once'] = True
+        elif not arg.isdigit() or int(arg) < 1:
+            raise Exception('need worker count which is greater than 0')
+        else:
+            params['worker_count'] = int(arg)
+
     path_source_root = './datasets/cue/raw/'
     path_target_root = './datasets/cue/{}/'.format(params['sample_rate'])
 
@@ -306,25 +335,121 @@ def load_cues(path):
     return cues
 
 
-def extract_span(cues, source_mp3_file, source_hash, target_dir_path,
-                 sample_rate, head_ms, tail_ms):
+class ExtractionManifest(object):
     """
+    progress of training data extraction in a sqlite database.
+
+    sources: sources (keyed by source hash, the prefix of its outputs) whose
+             spans are all extracted.
+    spans: completed outputs (name without extension) and their sources.
     """
-    if cues is None:
-        cues = []
+    def __init__(self, path):
+        """
+        path: path to the database. created if it's not exist.
+        """
+        self._is_new = not os.path.isfile(path)
+
+        self._connection = sqlite3.connect(path)
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS sources ('
+            'source_hash TEXT PRIMARY KEY, span_count INTEGER)')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS spans ('
+            'target_name TEXT PRIMARY KEY, source_hash TEXT)')
+        self._connection.execute(
+            'CREATE INDEX IF NOT EXISTS spans_source ON spans (source_hash)')
+        self._connection.commit()
+
+        self._pending_count = 0
+
+    def is_new(self):
+        """
+        return true if the database was created by this object.
+        """
+        return self._is_new
+
+    def done_sources(self):
+        """
+        return the set of hashes of completely extracted sources.
+        """
+        cursor = self._connection.execute('SELECT source_hash FROM sources')
+
+        return set(row[0] for row in cursor)
+
+    def done_spans(self, source_hash):
+        """
+        return the set of completed output names of a source.
+        """
+        cursor = self._connection.execute(
+            'SELECT target_name FROM spans WHERE source_hash = ?',
+            (source_hash,))
+
+        return set(row[0] for row in cursor)
+
+    def add_span(self, source_hash, target_name):
+        """
+        record a completed span.
+        """
+        self._connection.execute(
+            'INSERT OR REPLACE INTO spans VALUES (?, ?)',
+            (target_name, source_hash))
+
+        # batch commits, one transaction per span is slow
+        self._pending_count += 1
+
+        if self._pending_count >= 1000:
+            self.commit()
+
+    def finish_source(self, source_hash, span_count):
+        """
+        mark a source as completely extracted.
+        """
+        self._connection.execute(
+            'INSERT OR REPLACE INTO sources VALUES (?, ?)',
+            (source_hash, span_count))
+
+    def commit(self):
+        """
+        """
+        self._connection.commit()
+
+        self._pending_count = 0
+
+    def close(self):
+        """
+        """
+        self.commit()
+
+        self._connection.close()
 
+
+def span_target_paths(source_mp3_file, source_hash, target_dir_path,
+                      head_ms, tail_ms):
+    """
+    return paths of the extracted srt and wav of a span.
+    """
     target_hash = '{}{}{}'.format(source_mp3_file, head_ms, tail_ms)
     target_name = hashlib.md5(target_hash).hexdigest()
     target_name = '{}_{}'.format(source_hash, target_name)
     target_srt_path = target_dir_path + target_name + '.srt'
     target_wav_path = target_dir_path + target_name + '.wav'
 
-    if os.path.isfile(target_srt_path):
-        return
+    return target_srt_path, target_wav_path
 
-    SrtWriter.save(target_srt_path, cues, head_ms)
 
-    command = 'ffmpeg'
+def extract_span(cues, source_mp3_file, source_hash, target_dir_path,
+                 sample_rate, head_ms, tail_ms):
+    """
+    extract [head_ms, tail_ms) of source_mp3_file as a wav with its srt.
+    return the exit status of ffmpeg. the outputs appear only if it succeeds.
+    """
+    if cues is None:
+        cues = []
+
+    target_srt_path, target_wav_path = span_target_paths(
+        source_mp3_file, source_hash, target_dir_path, head_ms, tail_ms)
+
+    command = 'ffmpeg -y -nostdin'
     command += ' -i {}'.format(source_mp3_file)
     command += ' -acodec pcm_f32le'
     command += ' -ss {}'.format(ms_to_timestamp(head_ms))
@@ -332,15 +457,167 @@ def extract_span(cues, source_mp3_file, source_hash, target_dir_path,
     command += ' -ac 1'
     command += ' -ar {}'.format(sample_rate)
     command += ' -map_metadata -1 -write_xing 0'
-    command += ' {}'.format(target_wav_path)
+    command += ' -f wav {}.part'.format(target_wav_path)
+
+    code = os.system(command)
+
+    if code != 0:
+        if os.path.isfile(target_wav_path + '.part'):
+            os.remove(target_wav_path + '.part')
+
+        return code
+
+    SrtWriter.save(target_srt_path + '.part', cues, head_ms)
+
+    os.rename(target_wav_path + '.part', target_wav_path)
+    os.rename(target_srt_path + '.part', target_srt_path)
+
+    return code
+
+
+def extract_span_job(job):
+    """
+    run one planned span. a job is the argument tuple of extract_span. return
+    [(job, exit status)] so the caller can report failed spans.
+    """
+    return [(job, extract_span(*job))]
+
+
+def extract_source_job(jobs):
+    """
+    decode the source mp3 of jobs once, then write every span as a slice of
+    the decoded samples. all jobs must share the same source mp3 and sample
+    rate. return [(job, exit status)], the status is None for a span which
+    is empty (e.g. it starts after the end of the decoded audio) and has no
+    outputs.
+
+    the decoded samples are in the system temporary directory, not in the
+    target directory.
+    """
+    pending = []
+    results = []
+
+    for job in jobs:
+        _, source_mp3_file, source_hash, target_dir_path, _, \
+            head_ms, tail_ms = job
+
+        target_srt_path, target_wav_path = span_target_paths(
+            source_mp3_file, source_hash, target_dir_path, head_ms, tail_ms)
+
+        pending.append((job, target_srt_path, target_wav_path))
+
+    if len(pending) == 0:
+        return results
+
+    _, source_mp3_file, _, _, sample_rate, _, _ = jobs[0]
+
+    handle, raw_path = tempfile.mkstemp(prefix='extractor_', suffix='.raw')
 
-    os.system(command)
+    try:
+        os.close(handle)
+
+        command = 'ffmpeg -y -nostdin'
+        command += ' -i {}'.format(source_mp3_file)
+        command += ' -f f32le -acodec pcm_f32le'
+        command += ' -ac 1'
+        command += ' -ar {}'.format(sample_rate)
+        command += ' -map_metadata -1'
+        command += ' {}'.format(raw_path)
+
+        code = os.system(command)
+
+        if code != 0 or os.path.getsize(raw_path) == 0:
+            return results + [(p[0], code or -1) for p in pending]
+
+        samples = np.memmap(raw_path, dtype=np.float32, mode='r')
+
+        for job, target_srt_path, target_wav_path in pending:
+            cues, head_ms, tail_ms = job[0], job[5], job[6]
+
+            head = head_ms * sample_rate / 1000
+            tail = min(tail_ms * sample_rate / 1000, samples.size)
+
+            # nothing to extract, the span is done
+            if head >= tail:
+                results.append((job, None))
+                continue
+
+            wav.write(target_wav_path + '.part', sample_rate,
+                      np.array(samples[head:tail]))
+
+            SrtWriter.save(target_srt_path + '.part', cues or [], head_ms)
+
+            os.rename(target_wav_path + '.part', target_wav_path)
+            os.rename(target_srt_path + '.part', target_srt_path)
+
+            results.append((job, 0))
+
+        del samples
+    finally:
+        os.remove(raw_path)
+
+    return results
+
+
+def run_jobs(jobs, worker_count, decode_once=False, manifest=None):
+    """
+    run planned span jobs on a process pool. return the failed jobs with their
+    exit status. empty spans are skipped, they are neither failures nor
+    recorded in the manifest.
+
+    jobs: list of argument tuples of extract_span.
+    worker_count: number of worker processes.
+    decode_once: group jobs by source mp3 and decode each source only once.
+    manifest: an ExtractionManifest to record completed spans in.
+    """
+    failures = []
+    skipped_count = 0
+
+    if len(jobs) == 0:
+        return failures
+
+    if decode_once:
+        groups = {}
+
+        for job in jobs:
+            groups.setdefault(job[1], []).append(job)
+
+        tasks, worker = groups.values(), extract_source_job
+    else:
+        tasks, worker = jobs, extract_span_job
+
+    pool = multiprocessing.Pool(worker_count)
+
+    try:
+        for results in pool.imap_unordered(worker, tasks):
+            for job, code in results:
+                if code is None:
+                    skipped_count += 1
+                elif code != 0:
+                    failures.append((job, code))
+                elif manifest is not None:
+                    manifest.add_span(job[2], span_target_name(job))
+    finally:
+        pool.close()
+        pool.join()
+
+        if manifest is not None:
+            manifest.commit()
+
+    if skipped_count > 0:
+        print 'skipped {} empty spans'.format(skipped_count)
+
+    return failures
 
 
 def extract_sound(cues, source_mp3_file, source_hash, target_dir_path,
                   sample_rate):
     """
+    plan spans without voice (between cues). return a list of argument tuples
+    of extract_span.
     """
+    jobs = []
+
     previous_ending_ms = 0
 
     for idx, cue in enumerate(cues):
@@ -357,16 +634,22 @@ def extract_sound(cues, source_mp3_file, source_hash, target_dir_path,
             head_ms = span_head_ms
             tail_ms = min(head_ms + 10000, span_tail_ms)
 
-            extract_span([], source_mp3_file, source_hash, target_dir_path,
-                         sample_rate, head_ms, tail_ms)
+            jobs.append(([], source_mp3_file, source_hash, target_dir_path,
+                         sample_rate, head_ms, tail_ms))
 
             span_head_ms = tail_ms
 
+    return jobs
+
 
 def extract_voice(cues, source_mp3_file, source_hash, target_dir_path,
                   sample_rate):
     """
+    plan spans of (merged) valid cues. return a list of argument tuples of
+    extract_span.
     """
+    jobs = []
+
     previous_ending_ms = 0
 
     current_cue = None
@@ -383,8 +666,9 @@ def extract_voice(cues, source_mp3_file, source_hash, target_dir_path,
                     current_cue._tail_timestamp_ms + 2000,
                     cue._head_timestamp_ms)
 
-                extract_span([current_cue], source_mp3_file, source_hash,
-                             target_dir_path, sample_rate, head_ms, tail_ms)
+                jobs.append((
+                    [current_cue], source_mp3_file, source_hash,
+                    target_dir_path, sample_rate, head_ms, tail_ms))
 
                 current_cue = None
 
@@ -412,8 +696,9 @@ def extract_voice(cues, source_mp3_file, source_hash, target_dir_path,
             current_cue._tail_timestamp_ms + 2000
             if next_cue is None else next_cue._head_timestamp_ms)
 
-        extract_span([current_cue], source_mp3_file, source_hash,
-                     target_dir_path, sample_rate, head_ms, tail_ms)
+        jobs.append((
+            [current_cue], source_mp3_file, source_hash,
+            target_dir_path, sample_rate, head_ms, tail_ms))
 
         previous_ending_ms = current_cue._tail_timestamp_ms
 
@@ -426,49 +711,142 @@ def extract_voice(cues, source_mp3_file, source_hash, target_dir_path,
 
         tail_ms = current_cue._tail_timestamp_ms + 2000
 
-        extract_span([current_cue], source_mp3_file, source_hash,
-                     target_dir_path, sample_rate, head_ms, tail_ms)
+        jobs.append((
+            [current_cue], source_mp3_file, source_hash,
+            target_dir_path, sample_rate, head_ms, tail_ms))
+
+    return jobs
+
+
+def span_target_name(job):
+    """
+    output name (without extension) of a planned span.
+    """
+    _, source_mp3_file, source_hash, target_dir_path, _, head_ms, tail_ms = job
+
+    target_srt_path, _ = span_target_paths(
+        source_mp3_file, source_hash, target_dir_path, head_ms, tail_ms)
+
+    return os.path.splitext(os.path.basename(target_srt_path))[0]
+
+
+def is_complete_wav(path):
+    """
+    return true if the riff and data chunk sizes in the header of a wav match
+    its file size. ffmpeg writes them when it finishes, a killed one leaves 0
+    or 0xffffffff there.
+    """
+    size = os.path.getsize(path)
+
+    with open(path, 'rb') as source:
+        header = source.read(12)
+
+        if len(header) < 12 or header[:4] != 'RIFF' or \
+                header[8:] != 'WAVE' or \
+                struct.unpack('<I', header[4:8])[0] != size - 8:
+            return False
+
+        offset = 12
+
+        while offset + 8 <= size:
+            source.seek(offset)
+
+            chunk_id, chunk_size = struct.unpack('<4sI', source.read(8))
+
+            # data is the last chunk, maybe with a pad byte
+            if chunk_id == 'data':
+                return size - offset - 8 - chunk_size in [0, chunk_size & 1]
+
+            offset += 8 + chunk_size + (chunk_size & 1)
+
+    return False
+
+
+def import_legacy_outputs(manifest, target_dir_path):
+    """
+    record outputs extracted before the manifest existed. this is the only
+    scan of the target directory and happens once. wavs with incomplete
+    headers are left out, so they are extracted again.
+    """
+    for name in collect_file_names(target_dir_path, 'srt'):
+        name = os.path.splitext(name)[0]
+
+        tags = name.rsplit('_', 1)
+
+        wav_path = os.path.join(target_dir_path, name + '.wav')
+
+        if len(tags) > 1 and os.path.isfile(wav_path) and \
+                is_complete_wav(wav_path):
+            manifest.add_span(tags[0], name)
+
+    manifest.commit()
 
 
 def prepare_training_data(params):
     """
+    plan missing spans of sources which are not done then extract them in
+    parallel.
     """
-    # build name table
-    target_names = {}
+    sample_rate = params['sample_rate']
+    target_dir_path = params['path_target_training']
+    source_dir_path = params['path_source_training']
 
-    target_temp = collect_file_names(params['path_target_training'], 'srt')
+    manifest = ExtractionManifest(target_dir_path + 'manifest.sqlite')
 
-    for name in target_temp:
-        name = os.path.split(name)[1]
+    if manifest.is_new():
+        import_legacy_outputs(manifest, target_dir_path)
 
-        tags = name.split('_')
+    done_sources = manifest.done_sources()
 
-        if len(tags) > 1:
-            target_names[tags[-2]] = None
+    jobs = []
+    plans = {}
 
-    source_names = collect_file_names(params['path_source_training'], 'srt')
+    source_names = collect_file_names(source_dir_path, 'srt')
 
     for source_name in source_names:
         source_name = os.path.splitext(source_name)[0]
         source_hash = source_name[:-24]
 
         # processed?
-        if source_hash in target_names:
+        if source_hash in done_sources:
             continue
 
-        sample_rate = params['sample_rate']
-        target_dir_path = params['path_target_training']
-        source_dir_path = params['path_source_training']
         source_srt_file = source_dir_path + source_name + '.srt'
         source_mp3_file = source_dir_path + source_name + '.mp3'
 
         cues = load_cues(source_srt_file)
 
-        extract_sound(
+        source_jobs = extract_sound(
             cues, source_mp3_file, source_hash, target_dir_path, sample_rate)
-        extract_voice(
+        source_jobs += extract_voice(
             cues, source_mp3_file, source_hash, target_dir_path, sample_rate)
 
+        plans[source_hash] = len(source_jobs)
+
+        done_spans = manifest.done_spans(source_hash)
+
+        jobs.extend([job for job in source_jobs
+                     if span_target_name(job) not in done_spans])
+
+    print 'extracting {} spans of {} sources with {} workers'.format(
+        len(jobs), len(plans), params['worker_count'])
+
+    failures = run_jobs(
+        jobs, params['worker_count'], params['decode_once'], manifest)
+
+    failed_sources = set()
+
+    for job, code in failures:
+        failed_sources.add(job[2])
+
+        print 'failed ({}): {} [{}, {})'.format(code, job[1], job[5], job[6])
+
+    for source_hash, span_count in plans.items():
+        if source_hash not in failed_sources:
+            manifest.finish_source(source_hash, span_count)
+
+    manifest.close()
+
 
 def prepare_test_data_x(path_source, path_target):
     """
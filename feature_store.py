@@ -0,0 +1,194 @@
+"""
+pack features and labels of a split into flat files which can be memory
+mapped, for corpora which do not fit in memory.
+
+usage:
+    python feature_store.py <param file>
+
+build stores of all splits from the outputs of extractor.py/speak.py:
+
+datasets +-+ store +-+ sample_rate +-+ training +-+ wav.f32
+                                                +-+ srt.i8
+                                                +-+ offsets.npy
+                                                +-+ names.txt
+                                                +-+ meta.json
+                                   +-+ validate +-+ ...
+                                   +-+ test     +-+ ...
+
+wav.f32: float32 features of all files, shape [total_frame_size, cepstrum].
+srt.i8: int8 labels of all files, shape [total_frame_size].
+offsets.npy: file i spans frames [offsets[i], offsets[i + 1]).
+
+all processes which open the same store share its pages in the page cache.
+"""
+import json
+import os
+import numpy as np
+
+from batch_loader import load_sample
+from corpus import Corpus
+from parameters import Parameters
+
+
+class FeatureStore(object):
+    """
+    read only view of a store.
+    """
+    @staticmethod
+    def meta(params):
+        """
+        parameters which the packed features depend on.
+        """
+        return {
+            'wav_sample_rate': params.get_wav_sample_rate(),
+            'wav_cepstrum_size': params.get_wav_cepstrum_size(),
+            'wav_window_size': params.get_wav_window_size(),
+            'wav_window_step': params.get_wav_window_step(),
+        }
+
+    @staticmethod
+    def build(params, data_dir, store_dir):
+        """
+        pack all wav/srt pairs under data_dir into store_dir. files are
+        written under temporary names and renamed at the end, so readers
+        never see a partial store. a split without files makes an empty
+        store.
+        """
+        Parameters.make_dir(store_dir)
+
+        names = sorted(
+            os.path.splitext(name)[0] for name in os.listdir(data_dir)
+            if name.endswith('.wav'))
+
+        def temp(name):
+            return os.path.join(store_dir, name + '.tmp')
+
+        offsets = [0]
+
+        with open(temp('wav.f32'), 'wb') as wav_file, \
+                open(temp('srt.i8'), 'wb') as srt_file:
+            for name in names:
+                wav_features, srt_features = \
+                    load_sample(params, data_dir, name)
+
+                wav_features.astype(np.float32).tofile(wav_file)
+                srt_features.astype(np.int8).tofile(srt_file)
+
+                offsets.append(offsets[-1] + len(wav_features))
+
+        with open(temp('offsets.npy'), 'wb') as target:
+            np.save(target, np.array(offsets, dtype=np.int64))
+
+        with open(temp('names.txt'), 'w') as target:
+            target.write(''.join(name + '\n' for name in names))
+
+        with open(temp('meta.json'), 'w') as target:
+            json.dump(FeatureStore.meta(params), target, indent=2)
+
+        # meta.json last, its existence marks a complete store. remove the
+        # one of an old store first, or it would mark a mix of old and new
+        # files as complete while they are renamed
+        meta_path = os.path.join(store_dir, 'meta.json')
+
+        if os.path.isfile(meta_path):
+            os.remove(meta_path)
+
+        for name in ['wav.f32', 'srt.i8', 'offsets.npy', 'names.txt',
+                     'meta.json']:
+            os.rename(temp(name), os.path.join(store_dir, name))
+
+        return len(names), offsets[-1]
+
+    def __init__(self, params, store_dir):
+        """
+        open a store. raise if it was built with other feature parameters.
+        """
+        meta_path = os.path.join(store_dir, 'meta.json')
+
+        if not os.path.isfile(meta_path):
+            raise Exception('need a feature store in {}'.format(store_dir))
+
+        with open(meta_path) as source:
+            meta = json.load(source)
+
+        if meta != FeatureStore.meta(params):
+            raise Exception('feature store was built with other parameters')
+
+        self._offsets = np.load(os.path.join(store_dir, 'offsets.npy'))
+
+        with open(os.path.join(store_dir, 'names.txt')) as source:
+            self._names = [line.rstrip('\n') for line in source]
+
+        frame_size = int(self._offsets[-1])
+
+        self._store_dir = store_dir
+
+        # empty files can't be memory mapped
+        if frame_size == 0:
+            self._wav = np.zeros(
+                (0, meta['wav_cepstrum_size']), dtype=np.float32)
+            self._srt = np.zeros((0,), dtype=np.int8)
+
+            return
+
+        self._wav = np.memmap(
+            os.path.join(store_dir, 'wav.f32'),
+            dtype=np.float32,
+            mode='r',
+            shape=(frame_size, meta['wav_cepstrum_size']))
+        self._srt = np.memmap(
+            os.path.join(store_dir, 'srt.i8'),
+            dtype=np.int8,
+            mode='r',
+            shape=(frame_size,))
+
+    def names(self):
+        """
+        """
+        return list(self._names)
+
+    def file_count(self):
+        """
+        """
+        return len(self._names)
+
+    def wav_features(self, idx):
+        """
+        features of file idx, a view of the memory map.
+        """
+        return self._wav[self._offsets[idx]:self._offsets[idx + 1]]
+
+    def srt_features(self, idx):
+        """
+        labels of file idx, a view of the memory map.
+        """
+        return self._srt[self._offsets[idx]:self._offsets[idx + 1]]
+
+    def corpus(self):
+        """
+        a Corpus over the memory maps. nothing is copied until windows are
+        sampled.
+        """
+        if len(self._wav) == 0:
+            raise Exception('need files in {}'.format(self._store_dir))
+
+        return Corpus(self._wav, self._srt, self._offsets)
+
+
+if __name__ == "__main__":
+    """
+    """
+    params = Parameters()
+
+    splits = [
+        (params.get_dir_cue_training(), params.get_dir_store_training()),
+        (params.get_dir_cue_validate(), params.get_dir_store_validate()),
+        (params.get_dir_cue_test(), params.get_dir_store_test()),
+    ]
+
+    for data_dir, store_dir in splits:
+        file_count, frame_size = \
+            FeatureStore.build(params, data_dir, store_dir)
+
+        print 'packed {} files, {} frames into {}'.format(
+            file_count, frame_size, store_dir)
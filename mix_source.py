@@ -0,0 +1,161 @@
+"""
+synthetic training data mixed in memory at train time, the same way as
+speak.py:mix but with fresh random voices, gains and placements for every
+sample and no wav/srt written to disk.
+
+expects the outputs of speak.py:resample_voices/resample_bg:
+
+datasets +-+ bg    +-+ sample_rate +-+ training +-+ *.wav
+         +-+ voice +-+ sample_rate +-+ training +-+ *.wav
+"""
+import os
+import numpy as np
+import scipy.io.wavfile as wav
+
+import stage_timer
+from srt_features import SrtFeatures
+from wav_features import WavFeatures
+
+
+def load_wavs(path_dir):
+    """
+    load all wavs under path_dir as float32 mono samples.
+    """
+    samples = []
+
+    for name in sorted(os.listdir(path_dir)):
+        if not name.endswith('.wav'):
+            continue
+
+        _, data = wav.read(os.path.join(path_dir, name))
+
+        if len(data.shape) > 1:
+            data = data[:, 0]
+
+        samples.append(np.array(data, dtype=np.float32))
+
+    return samples
+
+
+class MixSource(object):
+    """
+    """
+    def __init__(self, params, bground_dir, voice_dir):
+        """
+        load all background and voice clips into memory. should be done
+        before batch workers are forked so they share the samples.
+        """
+        self._batch_size = params.get_batch_size()
+        self._sample_rate = params.get_wav_sample_rate()
+        self._window_size = params.get_wav_window_size()
+        self._window_step = params.get_wav_window_step()
+        self._numcep = params.get_wav_cepstrum_size()
+
+        # each sample yields exactly this many frames
+        self._frame_size = params.get_corpus_window_size()
+        self._sample_size = \
+            (self._frame_size - 1) * self._window_step + self._window_size
+
+        self._bgms = [s for s in load_wavs(bground_dir)
+                      if len(s) >= self._sample_size]
+        self._voices = [s for s in load_wavs(voice_dir)
+                        if 0 < len(s) < self._sample_size]
+
+        if len(self._bgms) == 0:
+            raise Exception('need background longer than {} samples'.format(
+                self._sample_size))
+
+        if len(self._voices) == 0:
+            raise Exception('need voices in {}'.format(voice_dir))
+
+    def mix(self, rng):
+        """
+        mix random voices into a random background crop.
+
+        return:
+            samples, shape: [sample_size]
+            heads and tails of voices in samples.
+        """
+        bgm = self._bgms[rng.randint(0, len(self._bgms))]
+
+        head = rng.randint(0, len(bgm) - self._sample_size + 1)
+
+        samples = bgm[head:head + self._sample_size].copy()
+
+        heads = []
+        tails = []
+
+        index = 0
+
+        while True:
+            voice = self._voices[rng.randint(0, len(self._voices))]
+
+            # random gap before each voice. speak.mix always leaves one voice
+            # length, here it's 0 to 2 voice lengths (1 on average).
+            index += rng.randint(0, 2 * len(voice) + 1)
+
+            if index + len(voice) >= len(samples):
+                break
+
+            # same as speak.mix: the background under a voice is scaled by a
+            # random factor
+            factor = 0.5 * rng.random_sample()
+
+            span = slice(index, index + len(voice))
+
+            samples[span] = samples[span] * factor + voice
+
+            heads.append(index)
+            tails.append(index + len(voice))
+
+            index += len(voice)
+
+        return samples, np.array(heads, dtype=np.int64), \
+            np.array(tails, dtype=np.int64)
+
+    def sample(self, rng):
+        """
+        return:
+            wav features, shape: [frame_size, cepstrum_size]
+            srt features, shape: [frame_size]
+        """
+        with stage_timer.stage('mix'):
+            samples, heads, tails = self.mix(rng)
+
+        mixed_wav = WavFeatures()
+
+        window_size = float(self._window_size) / float(self._sample_rate)
+        window_step = float(self._window_step) / float(self._sample_rate)
+
+        with stage_timer.stage('mfcc'):
+            mixed_wav.load_samples(
+                samples,
+                self._sample_rate,
+                window_size=window_size,
+                window_step=window_step,
+                numcep=self._numcep)
+
+        wav_features = mixed_wav.features()
+
+        with stage_timer.stage('labels'):
+            srt_features = SrtFeatures.mask(
+                heads, tails, 0, len(wav_features), self._window_size,
+                self._window_step)
+
+        return wav_features, srt_features
+
+    def make_batch(self, rng):
+        """
+        return:
+            wav_batch, srt_batch
+        """
+        wav_batch = []
+        srt_batch = []
+
+        for i in xrange(self._batch_size):
+            wav_features, srt_features = self.sample(rng)
+
+            wav_batch.append(wav_features)
+            srt_batch.append(srt_features)
+
+        return wav_batch, srt_batch
@@ -3,17 +3,38 @@
 import numpy as np
 import tensorflow as tf
 
+from tensorflow.python.client import timeline
 
-class VadModel(object):
+import stage_timer
+from vad_model_base import VadModelBase
+
+
+class VadModel(VadModelBase):
     """
     """
-    def __init__(self, params):
+    def __init__(self, params, inference=False, replica=None):
         """
+        inference:
+            build the forward graph only. no loss, optimizer, summaries and
+            tensorboard log. the model can only 'detect'.
+        replica:
+            a parallel_train.Replica to train as one worker of a cluster.
+            None to train alone.
         """
+        self._inference = inference
+        self._replica = replica
+
+        # SyncReplicasOptimizer if gradients of replicas are aggregated
+        self._sync_optimizer = None
+
         self._session_name = params.get_session_name()
 
+        # chrome trace of the next session run is written here if it's set
+        self._trace_path = None
+
+        self._checkpoint_source_dir = params.get_checkpoint_source_path()
         self._checkpoint_source_path = tf.train.latest_checkpoint(
-            params.get_checkpoint_source_path())
+            self._checkpoint_source_dir)
         self._checkpoint_target_path = \
             params.get_checkpoint_target_path()
 
@@ -26,6 +47,40 @@ class VadModel(object):
         # how many samples to delay
         self._srt_delay_size = params.get_srt_delay_size()
 
+        # variables are placed on parameter servers for data parallel
+        # training
+        device = None if replica is None else replica.device_setter()
+
+        with tf.device(device):
+            self.build_graph(params, inference)
+
+            self._saver = tf.train.Saver()
+
+        # threads of the session inherit the affinity
+        params.set_cpu_affinity(params.get_cpu_affinity())
+
+        if replica is not None:
+            self._session = self.build_replica_session(params, replica)
+        else:
+            self._session = tf.Session(config=params.get_session_config())
+
+            # restore check point
+            if self._checkpoint_source_path is not None:
+                self._saver.restore(
+                    self._session, self._checkpoint_source_path)
+            else:
+                self._session.run(tf.global_variables_initializer())
+
+        if inference or not self.is_chief():
+            self._reporter = None
+        else:
+            self._reporter = tf.summary.FileWriter(
+                params.get_tensorboard_log_path(), self._session.graph)
+
+    def build_graph(self, params, inference):
+        """
+        build placeholders, layers, rnn and, if not inference, training ops.
+        """
         # dropout
         if params.should_dropout_after_rnn():
             self._dropout_prob_after_rnn = tf.placeholder(tf.float32)
@@ -35,29 +90,14 @@ class VadModel(object):
             self._dropout_prob_after_rnn = None
             self._dropout_prob_after_rnn_value = 1.0
 
-        # batch sample weights for delay
-        self._batch_sample_weights = tf.placeholder(
-            tf.float32,
-            [self._training_sequence_size])
-
         # source data, wav features batch
         self._source_data = tf.placeholder(
             tf.float32,
             [None, self._training_sequence_size, self._wav_cepstrum_size])
 
-        # label data, srt features batch
-        self._target_data = tf.placeholder(
-            tf.int32, [None, self._training_sequence_size])
-
         #
         source, last_size = self.build_nn_before_rnn(params, self._source_data)
 
-        # split source to feature list
-        source = tf.reshape(
-            source, [-1, self._training_sequence_size * last_size])
-
-        source = tf.split(1, self._training_sequence_size, source)
-
         # batch size
         batch_size = tf.shape(self._source_data)[0]
 
@@ -65,10 +105,28 @@ class VadModel(object):
         rnn_cell = params.get_rnn_cell()
 
         self._state = rnn_cell.zero_state(batch_size, tf.float32)
+        self._state_size = rnn_cell.state_size
 
         # build rnn
-        outputs, self._last_state = tf.nn.seq2seq.rnn_decoder(
-            source, self._state, rnn_cell)
+        if params.should_use_dynamic_rnn():
+            # a while loop, graph size does not depend on the sequence length.
+            # share the variable scope of rnn_decoder so both cores can
+            # restore the same checkpoints.
+            source = tf.reshape(
+                source, [-1, self._training_sequence_size, last_size])
+
+            outputs, self._last_state = tf.nn.dynamic_rnn(
+                rnn_cell, source, initial_state=self._state,
+                scope='rnn_decoder')
+        else:
+            # split source to feature list
+            source = tf.reshape(
+                source, [-1, self._training_sequence_size * last_size])
+
+            source = tf.split(1, self._training_sequence_size, source)
+
+            outputs, self._last_state = tf.nn.seq2seq.rnn_decoder(
+                source, self._state, rnn_cell)
 
         #
         logits = self.build_nn_after_rnn(params, outputs)
@@ -77,6 +135,28 @@ class VadModel(object):
         self._masks = tf.reshape(
             self._masks, [-1, self._training_sequence_size])
 
+        # global step
+        initializer_z = tf.constant_initializer(0.0)
+
+        self._global_step = tf.get_variable(
+            "gstep", [], trainable=False, initializer=initializer_z)
+
+        if not inference:
+            self.build_training(params, logits, batch_size)
+
+    def build_training(self, params, logits, batch_size):
+        """
+        build loss, optimizer, accuracy and summaries.
+        """
+        # batch sample weights for delay
+        self._batch_sample_weights = tf.placeholder(
+            tf.float32,
+            [self._training_sequence_size])
+
+        # label data, srt features batch
+        self._target_data = tf.placeholder(
+            tf.int32, [None, self._training_sequence_size])
+
         # final
         probabilities = tf.nn.softmax(logits)
 
@@ -92,14 +172,13 @@ class VadModel(object):
 
         self._loss = tf.reduce_sum(total_loss) / total_size
 
-        # global step
-        initializer_z = tf.constant_initializer(0.0)
-
-        self._global_step = tf.get_variable(
-            "gstep", [], trainable=False, initializer=initializer_z)
-
         # trainer
         self._trainer = self.build_optimizer(params)
+
+        if self._replica is not None and self._replica.should_sync():
+            self._trainer = self._sync_optimizer = \
+                self._replica.sync_optimizer(self._trainer)
+
         self._trainer = self._trainer.minimize(
             self._loss, global_step=self._global_step)
 
@@ -112,22 +191,10 @@ class VadModel(object):
 
         self._judge = tf.reduce_sum(correctness) / total_size
 
-        #
-        self._session = tf.Session()
-
-        # restore check point
-        if self._checkpoint_source_path is not None:
-            tf.train.Saver().restore(
-                self._session, self._checkpoint_source_path)
-        else:
-            self._session.run(tf.global_variables_initializer())
-
         tf.summary.scalar('training loss', self._loss)
         tf.summary.scalar('training accuracy', self._judge)
 
         self._summaries = tf.summary.merge_all()
-        self._reporter = tf.summary.FileWriter(
-            params.get_tensorboard_log_path(), self._session.graph)
 
     def build_nn_before_rnn(self, params, source):
         """
@@ -186,7 +253,12 @@ class VadModel(object):
         dims = params.get_hidden_layer_dim_after_rnn()
         size = params.get_rnn_unit_num()
 
-        source = tf.concat(1, source)
+        # outputs of static rnn is a list of [batch_size, rnn_unit_num], of
+        # dynamic rnn is [batch_size, sequence_size, rnn_unit_num]. both are
+        # flattened to batch major order.
+        if isinstance(source, list):
+            source = tf.concat(1, source)
+
         source = tf.reshape(source, [-1, params.get_rnn_unit_num()])
 
         idx_dropout = -1
@@ -245,13 +317,102 @@ class VadModel(object):
 
         return optimizer
 
+    def build_replica_session(self, params, replica):
+        """
+        join the cluster. the chief restores the latest checkpoint or
+        initializes the variables on the parameter servers, other workers
+        wait for it.
+        """
+        init_op = tf.global_variables_initializer()
+
+        options = {}
+
+        if self._sync_optimizer is not None:
+            # the graph is finalized by the supervisor, build the ops first
+            init_tokens_op = self._sync_optimizer.get_init_tokens_op()
+            chief_queue_runner = self._sync_optimizer.get_chief_queue_runner()
+
+            if replica.is_chief():
+                options['local_init_op'] = self._sync_optimizer.chief_init_op
+            else:
+                options['local_init_op'] = \
+                    self._sync_optimizer.local_step_init_op
+
+            options['ready_for_local_init_op'] = \
+                self._sync_optimizer.ready_for_local_init_op
+
+        # checkpoints are saved by save_checkpoint, summaries by
+        # save_summary
+        self._supervisor = tf.train.Supervisor(
+            is_chief=replica.is_chief(),
+            logdir=self._checkpoint_source_dir,
+            init_op=init_op,
+            saver=self._saver,
+            global_step=self._global_step,
+            summary_op=None,
+            summary_writer=None,
+            save_model_secs=0,
+            **options)
+
+        session = self._supervisor.prepare_or_wait_for_session(
+            replica.target(), config=params.get_session_config())
+
+        if self._sync_optimizer is not None and replica.is_chief():
+            session.run(init_tokens_op)
+
+            self._supervisor.start_queue_runners(
+                session, [chief_queue_runner])
+
+        return session
+
+    def is_chief(self):
+        """
+        whether this model saves checkpoints and summaries. always true if
+        it's not a replica.
+        """
+        return self._replica is None or self._replica.is_chief()
+
+    def should_stop(self):
+        """
+        whether the replica was asked to stop. always false if it's not a
+        replica.
+        """
+        return self._replica is not None and self._replica.should_stop()
+
     def save_checkpoint(self):
         """
         """
-        saver = tf.train.Saver()
+        with stage_timer.stage('checkpoint'):
+            self._saver.save(self._session, self._checkpoint_target_path,
+                             global_step=self._global_step)
 
-        saver.save(self._session, self._checkpoint_target_path,
-                   global_step=self._global_step)
+    def restore(self, checkpoint_path=None):
+        """
+        restore variables from checkpoint_path, the latest checkpoint of the
+        session if it's None. return the restored path, None if there is no
+        checkpoint.
+        """
+        if checkpoint_path is None:
+            checkpoint_path = \
+                tf.train.latest_checkpoint(self._checkpoint_source_dir)
+
+        if checkpoint_path is not None:
+            self._saver.restore(self._session, checkpoint_path)
+
+            self._checkpoint_source_path = checkpoint_path
+
+        return checkpoint_path
+
+    def checkpoint_path(self):
+        """
+        path of the restored checkpoint, None if variables were initialized.
+        """
+        return self._checkpoint_source_path
+
+    def global_step(self):
+        """
+        """
+        return int(self._session.run(self._global_step, {}))
 
     def save_summary(self, gstep, tag=None, value=None, summary=None):
         """
@@ -259,6 +420,9 @@ class VadModel(object):
         if (tag is None or value is None) and (summary is None):
             raise Exception('need customized of specified summary')
 
+        if self._reporter is None:
+            raise Exception('inference model has no summary writer')
+
         if summary is None:
             summary_value = [tf.Summary.Value(tag=tag, simple_value=value)]
 
@@ -266,36 +430,25 @@ class VadModel(object):
 
         self._reporter.add_summary(summary, gstep)
 
-    def initial_states(self, source_wav):
+    def zero_states(self, batch_size):
         """
+        zero states of the rnn for batch_size streams. built on the host in
+        the structure of rnn_cell.state_size (e.g. LSTMStateTuple), so no
+        session run is needed.
         """
-        fetch = self._state
-
-        feeds = {
-            self._source_data: source_wav[:, :self._training_sequence_size]
-        }
-
-        return self._session.run(fetch, feeds)
-
-    def reshape_data(self, source, uni_length=None):
-        """
-        source:
-            the out-most container may be a list
-            shape: [batch_size, ?, feature_size]
-        uni_length:
-            desired length. find minimum length if it's None.
+        def zeros(size):
+            if isinstance(size, (int, long, np.integer)):
+                return np.zeros((batch_size, size), dtype=np.float32)
 
-        return:
-            shape: [batch_size, k * sequence_size, feature_size]
-        """
-        if uni_length is None:
-            sequence_size = self._training_sequence_size
+            states = [zeros(s) for s in size]
 
-            min_length = min([r.shape[0] for r in source])
+            # namedtuples, e.g. LSTMStateTuple
+            if hasattr(size, '_fields'):
+                return type(size)(*states)
 
-            uni_length = (min_length / sequence_size) * sequence_size
+            return tuple(states)
 
-        return np.vstack([r[None, :uni_length] for r in source])
+        return zeros(self._state_size)
 
     def work(self, task, states, source_wav, target_srt=None, sample_wgt=None):
         """
@@ -320,6 +473,9 @@ class VadModel(object):
             'test':   last_state, gstep, summary, loss, correctness
             'detect': last_state, masks
         """
+        if self._inference and task != 'detect':
+            raise Exception('inference model can only detect')
+
         fetch = [self._last_state]
 
         feeds = {
@@ -350,25 +506,60 @@ class VadModel(object):
             else:
                 feeds[self._dropout_prob_after_rnn] = 1.0
 
-        return self._session.run(fetch, feeds)
+        if self._trace_path is None:
+            return self._session.run(fetch, feeds)
+
+        options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+        metadata = tf.RunMetadata()
+
+        result = self._session.run(
+            fetch, feeds, options=options, run_metadata=metadata)
+
+        trace = timeline.Timeline(metadata.step_stats)
+
+        with open(self._trace_path, 'w') as target:
+            target.write(trace.generate_chrome_trace_format())
+
+        self._trace_path = None
 
-    def train(self, source_wav, target_srt):
+        return result
+
+    def trace_next_run(self, path):
+        """
+        write an op level timeline of the next session run to path. open it
+        in chrome://tracing.
+        """
+        self._trace_path = path
+
+    def train(self, source_wav, target_srt, states=None):
         """
+        states:
+            initial states of the batch, zero_states if it's None.
         """
         if self._srt_delay_size > 0:
             paddings = np.zeros((self._srt_delay_size))
             target_srt = [np.hstack((paddings, r)) for r in target_srt]
 
-        source_wav = self.reshape_data(source_wav)
-        target_srt = self.reshape_data(target_srt, source_wav.shape[1])
+        with stage_timer.stage('reshape'):
+            source_wav = self.reshape_data(source_wav)
+            target_srt = self.reshape_data(target_srt, source_wav.shape[1])
 
         sequence_size = self._training_sequence_size
         total_size = source_wav.shape[1]
-        last_states = self.initial_states(source_wav)
+
+        if states is None:
+            states = self.zero_states(source_wav.shape[0])
+
+        last_states = states
 
         temp_srt_delay = self._srt_delay_size
 
         for base in xrange(0, total_size, sequence_size):
+            # a stopped replica may never get the sync token of the next
+            # step, return the last finished one
+            if base > 0 and self.should_stop():
+                break
+
             # REVIEW: do we really need the weights for delays?
             sample_wgt = np.ones((sequence_size))
 
@@ -377,61 +568,45 @@ class VadModel(object):
 
                 temp_srt_delay -= sequence_size
 
-            result = self.work(
-                'train',
-                last_states,
-                source_wav[:, base:base+sequence_size],
-                target_srt[:, base:base+sequence_size],
-                sample_wgt)
+            with stage_timer.stage('session_run'):
+                result = self.work(
+                    'train',
+                    last_states,
+                    source_wav[:, base:base+sequence_size],
+                    target_srt[:, base:base+sequence_size],
+                    sample_wgt)
 
             last_states = result[0]
 
         # last_state, gstep, summary, loss, correctness, trainer
         return result
 
-    def test(self, source_wav, target_srt):
+    def forward(self, source_wav, states):
         """
-        """
-        gstep = self._session.run(self._global_step, {})
-
-        result_srt = self.detect(source_wav)
-
-        correctness_count = 0.0
-        correctness_value = 0.0
-
-        for i in xrange(result_srt.shape[0]):
-            size = min(result_srt[i].size, target_srt[i].size)
-
-            result = result_srt[i][:size]
-            target = target_srt[i][:size]
-
-            correctness_value += float(np.sum(result == target))
-            correctness_count += float(size)
-
-        # gstep, correctness
-        return gstep, (correctness_value / correctness_count)
+        source_wav:
+            shape: [batch_size, k * sequence_size, feature_size]
+        states:
+            initial states, from zero_states or the last states of a previous
+            call to continue the streams.
 
-    def detect(self, source_wav):
-        """
+        return:
+            masks of all frames, the delay is not removed.
+            shape: [batch_size, k * sequence_size]
+            last states
         """
-        # REVIEW: generator???
-        source_wav = self.reshape_data(source_wav)
         sequence_size = self._training_sequence_size
         total_size = source_wav.shape[1]
-        last_states = self.initial_states(source_wav)
 
         results = []
 
         for base in xrange(0, total_size, sequence_size):
             result = self.work(
                 'detect',
-                last_states,
+                states,
                 source_wav[:, base:base+sequence_size])
 
-            last_states = result[0]
+            states = result[0]
 
             results.append(result[1])
 
-        results = np.hstack(results)
-
-        return results[:, self._srt_delay_size:]
+        return np.hstack(results), states
@@ -0,0 +1,240 @@
+"""
+forward pass of VadModel in numpy, for detection without tensorflow.
+
+weights are exported once from the latest checkpoint of a session:
+
+    python numpy_model.py params/param_4k_baseline_deep.json
+
+which writes model.npz next to the checkpoints. detect.py uses this engine
+if 'detect_engine' is 'numpy' in the parameter file.
+"""
+import os
+import re
+import numpy as np
+
+from parameters import Parameters
+from vad_model_base import VadModelBase
+
+
+# variable names of tensorflow rnn cells -> names in the npz
+LSTM_VARIABLE_NAMES = {
+    'LSTMCell/W_0': 'lstm_w',
+    'LSTMCell/B': 'lstm_b',
+    'LSTMCell/W_F_diag': 'lstm_wf',
+    'LSTMCell/W_I_diag': 'lstm_wi',
+    'LSTMCell/W_O_diag': 'lstm_wo',
+    'BasicLSTMCell/Linear/Matrix': 'lstm_w',
+    'BasicLSTMCell/Linear/Bias': 'lstm_b',
+}
+
+
+def sigmoid(x):
+    """
+    """
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+class NumpyVadModel(VadModelBase):
+    """
+    """
+    @staticmethod
+    def export(params):
+        """
+        read weights of the latest checkpoint and save them to a npz.
+        optimizer slots are dropped.
+        """
+        import tensorflow as tf
+
+        checkpoint_path = tf.train.latest_checkpoint(
+            params.get_checkpoint_source_path())
+
+        if checkpoint_path is None:
+            raise Exception('need a checkpoint')
+
+        reader = tf.train.NewCheckpointReader(checkpoint_path)
+
+        weights = {}
+
+        for name in reader.get_variable_to_shape_map():
+            if re.match(r'^[ab][wb]\d+$', name):
+                weights[name] = reader.get_tensor(name)
+                continue
+
+            for suffix, target in LSTM_VARIABLE_NAMES.items():
+                if name == 'rnn_decoder/' + suffix:
+                    weights[target] = reader.get_tensor(name)
+
+        if 'lstm_w' not in weights:
+            raise Exception('need lstm weights in the checkpoint')
+
+        np.savez(params.get_numpy_weights_path(), **weights)
+
+        return checkpoint_path
+
+    def __init__(self, params):
+        """
+        """
+        weights_path = params.get_numpy_weights_path()
+
+        if not os.path.isfile(weights_path):
+            raise Exception('need exported weights: {}'.format(weights_path))
+
+        params.set_cpu_affinity(params.get_cpu_affinity())
+
+        with np.load(weights_path) as source:
+            self._weights = {
+                k: source[k].astype(np.float32) for k in source.files}
+
+        # number of samples of a sequence for training
+        self._training_sequence_size = params.get_rnn_sequence_length()
+
+        # how many samples to delay
+        self._srt_delay_size = params.get_srt_delay_size()
+
+        self._rnn_unit_num = params.get_rnn_unit_num()
+        self._forget_bias = np.float32(params.get_lstm_forget_bias())
+        self._use_peephole = params.should_use_lstm_peephole()
+
+        self._layers_before_rnn = self.build_layers(
+            'b',
+            params.get_hidden_layer_dim_before_rnn(),
+            params.should_add_bias_before_rnn(),
+            params.get_non_linear_gate_before_rnn(),
+            params.should_add_residual_before_rnn())
+
+        dims = params.get_hidden_layer_dim_after_rnn()
+
+        if len(dims) == 0 or dims[-1] != 2:
+            dims.append(2)
+
+        self._layers_after_rnn = self.build_layers(
+            'a',
+            dims,
+            params.should_add_bias_after_rnn(),
+            params.get_non_linear_gate_after_rnn(),
+            params.should_add_residual_after_rnn())
+
+    def build_layers(self, prefix, dims, use_bias, nonlinear, use_residual):
+        """
+        collect weights of dense layers named '{prefix}w{idx}' and
+        '{prefix}b{idx}'.
+        """
+        layers = []
+
+        for idx in xrange(len(dims)):
+            w = self._weights['{}w{}'.format(prefix, idx)]
+            b = self._weights['{}b{}'.format(prefix, idx)] if use_bias else 0
+
+            layers.append((w, b))
+
+        return layers, nonlinear, use_residual
+
+    def forward_layers(self, layers, source):
+        """
+        same as build_nn_before_rnn/build_nn_after_rnn of VadModel.
+        dropout is an identity for detection.
+        """
+        layers, nonlinear, use_residual = layers
+
+        for idx, (w, b) in enumerate(layers):
+            source = np.dot(source, w) + b
+
+            if idx + 1 < len(layers):
+                if nonlinear == 'relu':
+                    source = np.maximum(source, 0.0)
+                elif nonlinear == 'tanh':
+                    source = np.tanh(source)
+
+            if idx == 0:
+                residual = source
+            elif use_residual and idx + 1 < len(layers) and (idx % 2 == 2):
+                source = source + residual
+                residual = source
+
+        return source
+
+    def zero_states(self, batch_size):
+        """
+        (c, h) of the lstm, all zeros.
+        """
+        c = np.zeros((batch_size, self._rnn_unit_num), dtype=np.float32)
+        h = np.zeros((batch_size, self._rnn_unit_num), dtype=np.float32)
+
+        return c, h
+
+    def forward_rnn(self, source, states):
+        """
+        source:
+            shape: [batch_size, sequence_size, feature_size]
+        states:
+            (c, h), shape of each: [batch_size, rnn_unit_num]
+
+        return:
+            outputs, shape: [batch_size, sequence_size, rnn_unit_num]
+            last states
+        """
+        w = self._weights['lstm_w']
+        b = self._weights['lstm_b']
+
+        # inputs part of the matrix for all steps at once
+        size = source.shape[2]
+        gates_x = np.dot(source, w[:size]) + b
+        w_h = w[size:]
+
+        c, h = states
+
+        outputs = np.empty(
+            source.shape[:2] + (self._rnn_unit_num,), dtype=np.float32)
+
+        for t in xrange(source.shape[1]):
+            gates = gates_x[:, t] + np.dot(h, w_h)
+
+            i, j, f, o = np.split(gates, 4, axis=1)
+
+            if self._use_peephole:
+                c = sigmoid(f + self._forget_bias +
+                            self._weights['lstm_wf'] * c) * c + \
+                    sigmoid(i + self._weights['lstm_wi'] * c) * np.tanh(j)
+                h = sigmoid(o + self._weights['lstm_wo'] * c) * np.tanh(c)
+            else:
+                c = sigmoid(f + self._forget_bias) * c + \
+                    sigmoid(i) * np.tanh(j)
+                h = sigmoid(o) * np.tanh(c)
+
+            outputs[:, t] = h
+
+        return outputs, (c, h)
+
+    def forward(self, source_wav, states):
+        """
+        source_wav:
+            shape: [batch_size, ?, feature_size]
+
+        return:
+            masks, shape: [batch_size, ?]
+            last states
+        """
+        batch_size, total_size = source_wav.shape[:2]
+
+        source_wav = source_wav.astype(np.float32, copy=False)
+
+        source = source_wav.reshape(-1, source_wav.shape[2])
+        source = self.forward_layers(self._layers_before_rnn, source)
+        source = source.reshape(batch_size, total_size, -1)
+
+        source, states = self.forward_rnn(source, states)
+
+        source = source.reshape(-1, self._rnn_unit_num)
+        logits = self.forward_layers(self._layers_after_rnn, source)
+
+        masks = np.argmax(logits, axis=1).reshape(batch_size, total_size)
+
+        return masks, states
+
+
+if __name__ == "__main__":
+    """
+    """
+    params = Parameters()
+
+    print 'exported {}'.format(NumpyVadModel.export(params))
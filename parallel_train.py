@@ -0,0 +1,246 @@
+"""
+data parallel training with local worker processes.
+
+usage:
+    python parallel_train.py <param file>
+
+starts a parameter server and parallel_worker_count workers, each in its
+own process with its own batch loader. variables live on the parameter
+server, every worker builds the same VadModel graph and trains on its own
+batches.
+
+if parallel_sync is true, gradients of all workers are aggregated and
+applied once per step (SyncReplicasOptimizer). otherwise every worker
+applies its gradients to the parameter server as soon as they are computed.
+
+worker 0 is the chief: it restores or initializes variables, saves
+checkpoints (same layout as train.py), summaries and evaluates. tasks are
+on localhost from parallel_port by default, parallel_ps_hosts and
+parallel_worker_hosts may list other hosts.
+
+training ends when the chief is done or any worker fails. the other workers
+are asked to stop between steps; in sync mode they may be blocked on a
+token of the chief forever, so workers still running after
+parallel_stop_timeout seconds are killed with their batch loaders.
+"""
+import multiprocessing
+import os
+import signal
+import time
+import traceback
+import numpy as np
+import tensorflow as tf
+
+from evaluate import load_split
+from model import VadModel
+from parameters import Parameters
+from train import learn, make_batch_loader
+
+
+def make_cluster(params):
+    """
+    """
+    return tf.train.ClusterSpec({
+        'ps': params.get_parallel_ps_hosts(),
+        'worker': params.get_parallel_worker_hosts(),
+    })
+
+
+class Replica(object):
+    """
+    one worker of the cluster, for VadModel.
+    """
+    def __init__(self, params, task_index, stop_event):
+        """
+        stop_event: a multiprocessing.Event shared by all workers, set when
+        training is over.
+        """
+        self._task_index = task_index
+        self._stop_event = stop_event
+        self._worker_count = len(params.get_parallel_worker_hosts())
+        self._sync = params.should_sync_replicas()
+        self._cluster = make_cluster(params)
+        self._server = tf.train.Server(
+            self._cluster,
+            job_name='worker',
+            task_index=task_index,
+            config=params.get_session_config())
+
+    def device_setter(self):
+        """
+        variables on parameter servers, ops on this worker.
+        """
+        return tf.train.replica_device_setter(
+            worker_device='/job:worker/task:{}'.format(self._task_index),
+            cluster=self._cluster)
+
+    def target(self):
+        """
+        """
+        return self._server.target
+
+    def is_chief(self):
+        """
+        """
+        return self._task_index == 0
+
+    def should_stop(self):
+        """
+        """
+        return self._stop_event.is_set()
+
+    def should_sync(self):
+        """
+        """
+        return self._sync
+
+    def sync_optimizer(self, optimizer):
+        """
+        wrap optimizer to aggregate the gradients of all workers.
+        """
+        # tensorflow 0.12 has the token based optimizer as V2
+        optimizer_class = getattr(
+            tf.train, 'SyncReplicasOptimizerV2',
+            tf.train.SyncReplicasOptimizer)
+
+        return optimizer_class(
+            optimizer,
+            replicas_to_aggregate=self._worker_count,
+            total_num_replicas=self._worker_count)
+
+
+def run_ps(params, task_index):
+    """
+    parameter server process body.
+    """
+    server = tf.train.Server(
+        make_cluster(params),
+        job_name='ps',
+        task_index=task_index,
+        config=params.get_session_config())
+
+    server.join()
+
+
+def run_worker(params, task_index, stop_event):
+    """
+    worker process body.
+    """
+    # a process group of its own, so the parent can kill the worker with its
+    # batch loader
+    os.setpgrp()
+
+    # forked workers share the random state of the parent
+    np.random.seed()
+
+    try:
+        if task_index == 0 and params.should_evaluate_in_training():
+            test_samples = load_split(
+                params, params.get_dir_cue_test(),
+                params.get_evaluate_worker_count())
+        else:
+            test_samples = None
+
+        # fork loader workers before tensorflow starts its threads
+        loader = make_batch_loader(params, seed_offset=task_index)
+        loader.start()
+
+        try:
+            model = VadModel(
+                params, replica=Replica(params, task_index, stop_event))
+
+            learn(params, model, loader, test_samples)
+        finally:
+            loader.close()
+    except KeyboardInterrupt:
+        pass
+    except Exception:
+        traceback.print_exc()
+
+        raise
+    finally:
+        # only the chief feeds sync tokens, the others can't go on without it
+        if task_index == 0:
+            stop_event.set()
+
+
+def is_training(worker_processes):
+    """
+    true until the chief exits or any worker fails.
+    """
+    if not worker_processes[0].is_alive():
+        return False
+
+    return all(process.exitcode in (None, 0) for process in worker_processes)
+
+
+def stop_workers(worker_processes, timeout):
+    """
+    wait up to timeout seconds for workers to stop, then kill the rest with
+    their batch loaders.
+    """
+    deadline = time.time() + timeout
+
+    for process in worker_processes:
+        process.join(max(0.0, deadline - time.time()))
+
+    for process in worker_processes:
+        if process.is_alive():
+            print 'killing worker {}'.format(process.pid)
+
+            try:
+                os.killpg(process.pid, signal.SIGTERM)
+            except OSError:
+                # exited in the meantime
+                pass
+
+    for process in worker_processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    """
+    """
+    params = Parameters()
+
+    stop_event = multiprocessing.Event()
+
+    ps_processes = []
+    worker_processes = []
+
+    for task_index in xrange(len(params.get_parallel_ps_hosts())):
+        process = multiprocessing.Process(
+            target=run_ps, args=(params, task_index))
+
+        process.daemon = True
+        process.start()
+
+        ps_processes.append(process)
+
+    # workers fork batch loaders, so they can't be daemons
+    for task_index in xrange(len(params.get_parallel_worker_hosts())):
+        process = multiprocessing.Process(
+            target=run_worker, args=(params, task_index, stop_event))
+
+        process.start()
+
+        worker_processes.append(process)
+
+    try:
+        while is_training(worker_processes):
+            time.sleep(1.0)
+
+        stop_event.set()
+
+        stop_workers(worker_processes, params.get_parallel_stop_timeout())
+    except KeyboardInterrupt:
+        # workers are in their own process groups and don't get the ctrl-c
+        stop_event.set()
+
+        stop_workers(worker_processes, 0.0)
+    finally:
+        for process in ps_processes:
+            process.terminate()
+
+        for process in ps_processes:
+            process.join()
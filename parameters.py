@@ -3,7 +3,6 @@
 import json
 import os
 import sys
-import tensorflow as tf
 
 
 class Parameters(object):
@@ -16,6 +15,22 @@ class Parameters(object):
         if not os.path.isdir(dir_path):
             os.makedirs(dir_path)
 
+    @staticmethod
+    def set_cpu_affinity(cpus):
+        """
+        bind all threads of this process to cpus (a taskset cpu list, e.g.
+        '0-15'). threads created later inherit it, so it should be done
+        before the session or numpy starts its thread pools.
+        """
+        if cpus is None:
+            return
+
+        command = 'taskset -a -p -c {} {} > /dev/null'.format(
+            cpus, os.getpid())
+
+        if os.system(command) != 0:
+            raise Exception('failed to set cpu affinity: {}'.format(cpus))
+
     @staticmethod
     def arg():
         """
@@ -36,16 +51,34 @@ class Parameters(object):
         if name != 'param_{}.json'.format(param['session_name']):
             raise Exception('invalid session name')
 
-        if len(sys.argv) == 3:
-            if not os.path.isfile(sys.argv[2]):
+        # movies: wav files or directories of wav files
+        movie_paths = []
+
+        for path in sys.argv[2:]:
+            if os.path.isdir(path):
+                names = sorted(os.listdir(path))
+
+                movie_paths.extend([
+                    os.path.join(path, name) for name in names
+                    if name.endswith('.wav') and
+                    os.path.isfile(os.path.join(path, name))])
+            elif os.path.isfile(path):
+                movie_paths.append(path)
+            else:
                 raise Exception('invalid movie file path')
 
-            param['movie_path'] = sys.argv[2]
+        if len(movie_paths) > 0:
+            param['movie_path'] = movie_paths[0]
+            param['movie_paths'] = movie_paths
 
         return param
 
-    def __init__(self):
+    def __init__(self, root_dir='.', need_datasets=True):
         """
+        root_dir:
+            checkpoints, tensorboard logs, caches and datasets are under it.
+        need_datasets:
+            raise if the cue dirs of datasets do not exist.
         """
         self._params = param = Parameters.arg()
 
@@ -77,23 +110,45 @@ class Parameters(object):
         self._nn_hidden_layer_before_rnn = param['head_hidden_layers']
         self._nn_hidden_layer_after_rnn = param['tail_hidden_layers']
 
-        self._checkpoint_source_path = './checkpoints/{}/'.format(
-            self._session_name)
-        self._checkpoint_target_path = './checkpoints/{}/model.ckpt'.format(
-            self._session_name)
-        self._tensorboard_log_root = './tensorboards/'
-        self._tensorboard_log_path = './tensorboards/{}/'.format(
-            self._session_name)
+        self._checkpoint_source_path = '{}/checkpoints/{}/'.format(
+            root_dir, self._session_name)
+        self._checkpoint_target_path = \
+            '{}/checkpoints/{}/model.ckpt'.format(root_dir, self._session_name)
+        self._tensorboard_log_root = '{}/tensorboards/'.format(root_dir)
+        self._tensorboard_log_path = '{}/tensorboards/{}/'.format(
+            root_dir, self._session_name)
 
+        # tensorboard log dirs are created by the summary writer of the
+        # training model only
         Parameters.make_dir(self._checkpoint_source_path)
-        Parameters.make_dir(self._tensorboard_log_root)
 
-        self._dir_cue_training = './datasets/cue/{}/training/'.format(
-            self._wav_sample_rate)
-        self._dir_cue_validate = './datasets/cue/{}/validate/'.format(
-            self._wav_sample_rate)
-        self._dir_cue_test = './datasets/cue/{}/test/'.format(
-            self._wav_sample_rate)
+        self._wav_feature_cache_path = \
+            '{}/caches/wav_features/'.format(root_dir)
+
+        if self.should_cache_wav_features():
+            Parameters.make_dir(self._wav_feature_cache_path)
+
+        self._dir_cue_training = '{}/datasets/cue/{}/training/'.format(
+            root_dir, self._wav_sample_rate)
+        self._dir_cue_validate = '{}/datasets/cue/{}/validate/'.format(
+            root_dir, self._wav_sample_rate)
+        self._dir_cue_test = '{}/datasets/cue/{}/test/'.format(
+            root_dir, self._wav_sample_rate)
+
+        self._dir_store_training = '{}/datasets/store/{}/training/'.format(
+            root_dir, self._wav_sample_rate)
+        self._dir_store_validate = '{}/datasets/store/{}/validate/'.format(
+            root_dir, self._wav_sample_rate)
+        self._dir_store_test = '{}/datasets/store/{}/test/'.format(
+            root_dir, self._wav_sample_rate)
+
+        self._dir_bground_training = '{}/datasets/bg/{}/training/'.format(
+            root_dir, self._wav_sample_rate)
+        self._dir_voice_training = '{}/datasets/voice/{}/training/'.format(
+            root_dir, self._wav_sample_rate)
+
+        if not need_datasets:
+            return
 
         if not os.path.isdir(self._dir_cue_training):
             raise Exception('need training dir')
@@ -107,6 +162,11 @@ class Parameters(object):
         """
         return self._params['movie_path']
 
+    def get_movie_paths(self):
+        """
+        """
+        return list(self._params.get('movie_paths', []))
+
     def get_session_name(self):
         """
         """
@@ -137,6 +197,36 @@ class Parameters(object):
         """
         return self._batch_size
 
+    def get_random_seed(self):
+        """
+        """
+        return self._params.get('random_seed', None)
+
+    def get_loader_worker_count(self):
+        """
+        number of batch worker processes. batches are built in the training
+        process if it's 0, as before batch workers.
+        """
+        return self._params.get('loader_worker_count', 0)
+
+    def get_loader_queue_depth(self):
+        """
+        """
+        return self._params.get('loader_queue_depth', 4)
+
+    def get_corpus_window_size(self):
+        """
+        number of frames of a window sampled from the in-memory corpus.
+        """
+        return self.get_rnn_sequence_length() * \
+            self._params.get('corpus_window_sequences', 4)
+
+    def get_bucket_count(self):
+        """
+        number of length buckets of training files.
+        """
+        return self._params.get('bucket_count', 8)
+
     def get_optimizer(self):
         """
         """
@@ -155,6 +245,10 @@ class Parameters(object):
     def get_rnn_cell(self):
         """
         """
+        # tensorflow is only needed to build the graph. numpy inference does
+        # not import it.
+        import tensorflow as tf
+
         if self._params['rnn_cell'] == 'basiclstm':
             rnn_cell = tf.nn.rnn_cell.BasicLSTMCell(
                 self._params['rnn_unit_num'],
@@ -169,6 +263,44 @@ class Parameters(object):
 
         return rnn_cell
 
+    def get_session_config(self):
+        """
+        threads and graph optimization of tensorflow sessions. 0 threads let
+        tensorflow pick the number of cores.
+        """
+        import tensorflow as tf
+
+        opt_levels = {
+            'L0': tf.OptimizerOptions.L0,
+            'L1': tf.OptimizerOptions.L1,
+        }
+
+        opt_level = self._params.get('session_optimizer_level', 'L1')
+
+        if opt_level not in opt_levels:
+            raise Exception('invalid optimizer level: {}'.format(opt_level))
+
+        optimizer_options = tf.OptimizerOptions(
+            opt_level=opt_levels[opt_level])
+
+        return tf.ConfigProto(
+            intra_op_parallelism_threads=self._params.get(
+                'session_intra_op_threads', 0),
+            inter_op_parallelism_threads=self._params.get(
+                'session_inter_op_threads', 0),
+            graph_options=tf.GraphOptions(optimizer_options=optimizer_options))
+
+    def get_cpu_affinity(self):
+        """
+        taskset cpu list of the process, e.g. '0-15', or None to use all cpus.
+        """
+        return self._params.get('cpu_affinity', None)
+
+    def get_lstm_forget_bias(self):
+        """
+        """
+        return self._params['lstm_forget_bias']
+
     def get_rnn_unit_num(self):
         """
         """
@@ -179,6 +311,32 @@ class Parameters(object):
         """
         return self._params['rnn_sequence_length']
 
+    def get_detect_block_size(self):
+        """
+        number of frames per block of streaming detection.
+        """
+        return self.get_rnn_sequence_length() * \
+            self._params.get('detect_block_sequences', 64)
+
+    def get_detect_batch_size(self):
+        """
+        number of movies per detection batch.
+        """
+        return self._params.get('detect_batch_size', 8)
+
+    def get_detect_batch_wait_ms(self):
+        """
+        how long the detection service waits to gather a batch.
+        """
+        return self._params.get('detect_batch_wait_ms', 20)
+
+    def get_detect_socket_path(self):
+        """
+        """
+        return self._params.get(
+            'detect_socket_path',
+            './detect_{}.sock'.format(self._session_name))
+
     def get_wav_sample_rate(self):
         """
         """
@@ -204,6 +362,38 @@ class Parameters(object):
         """
         return self._wav_window_step
 
+    def get_benchmark_seconds(self):
+        """
+        length of the synthetic movie of benchmark.py.
+        """
+        return self._params.get('benchmark_seconds', 600)
+
+    def get_benchmark_repeat(self):
+        """
+        runs per stage of benchmark.py, the best one is reported.
+        """
+        return self._params.get('benchmark_repeat', 3)
+
+    def get_srt_min_segment_size(self):
+        """
+        detected segments shorter than this many frames are dropped.
+        """
+        return self._params.get('srt_min_segment_size', 0)
+
+    def get_srt_min_gap_size(self):
+        """
+        detected segments closer than this many frames are merged.
+        """
+        return self._params.get('srt_min_gap_size', 0)
+
+    def get_wav_feature_cache_path(self):
+        """
+        """
+        if not self.should_cache_wav_features():
+            return None
+
+        return self._wav_feature_cache_path
+
     def get_srt_delay_size(self):
         """
         """
@@ -239,11 +429,81 @@ class Parameters(object):
         """
         return self._checkpoint_source_path
 
+    def get_numpy_weights_path(self):
+        """
+        """
+        return os.path.join(self._checkpoint_source_path, 'model.npz')
+
     def get_checkpoint_target_path(self):
         """
         """
         return self._checkpoint_target_path
 
+    def get_timing_log_path(self):
+        """
+        json lines of stage timings of training.
+        """
+        return os.path.join(self._tensorboard_log_path, 'timing.jsonl')
+
+    def get_trace_path(self, gstep):
+        """
+        chrome trace of a training step.
+        """
+        return os.path.join(
+            self._tensorboard_log_path, 'timeline_{}.json'.format(gstep))
+
+    def get_parallel_ps_hosts(self):
+        """
+        host:port of parameter servers of parallel_train.py.
+        """
+        port = self._params.get('parallel_port', 2222)
+
+        return self._params.get(
+            'parallel_ps_hosts', ['localhost:{}'.format(port)])
+
+    def get_parallel_worker_hosts(self):
+        """
+        host:port of workers of parallel_train.py, one per worker.
+        """
+        port = self._params.get('parallel_port', 2222)
+        count = self._params.get('parallel_worker_count', 2)
+
+        return self._params.get(
+            'parallel_worker_hosts',
+            ['localhost:{}'.format(port + 1 + i) for i in xrange(count)])
+
+    def get_parallel_stop_timeout(self):
+        """
+        seconds the workers of parallel_train.py have to stop once the chief
+        is done, before they are killed.
+        """
+        return self._params.get('parallel_stop_timeout', 30)
+
+    def get_evaluation_log_path(self):
+        """
+        json lines of evaluate.py results.
+        """
+        return os.path.join(self._tensorboard_log_path, 'evaluation.jsonl')
+
+    def get_evaluate_worker_count(self):
+        """
+        number of processes which load features for evaluation.
+        """
+        return self._params.get('evaluate_worker_count', 4)
+
+    def get_evaluate_interval(self):
+        """
+        seconds between checks for new checkpoints of evaluate.py. evaluate
+        once if it's 0.
+        """
+        return self._params.get('evaluate_interval', 0)
+
+    def get_trace_interval(self):
+        """
+        write an op level timeline every this many steps. 0 to disable.
+        """
+        return self._params.get('trace_interval', 0)
+
     def get_tensorboard_log_path(self):
         """
         """
@@ -264,6 +524,31 @@ class Parameters(object):
         """
         return self._dir_cue_test
 
+    def get_dir_bground_training(self):
+        """
+        """
+        return self._dir_bground_training
+
+    def get_dir_voice_training(self):
+        """
+        """
+        return self._dir_voice_training
+
+    def get_dir_store_training(self):
+        """
+        """
+        return self._dir_store_training
+
+    def get_dir_store_validate(self):
+        """
+        """
+        return self._dir_store_validate
+
+    def get_dir_store_test(self):
+        """
+        """
+        return self._dir_store_test
+
     def should_use_adam(self):
         """
         """
@@ -274,6 +559,64 @@ class Parameters(object):
         """
         return self._wav_feature == 'mfcc'
 
+    def should_cache_wav_features(self):
+        """
+        """
+        return self._params.get('wav_feature_cache', False)
+
+    def should_use_corpus(self):
+        """
+        """
+        return self._params.get('batch_source', 'files') == 'corpus'
+
+    def should_use_mix_source(self):
+        """
+        """
+        return self._params.get('batch_source', 'files') == 'mix'
+
+    def should_use_bucket_sampler(self):
+        """
+        """
+        return self._params.get('batch_source', 'files') == 'bucket'
+
+    def should_use_feature_store(self):
+        """
+        """
+        return self._params.get('batch_source', 'files') == 'store'
+
+    def should_use_dynamic_rnn(self):
+        """
+        """
+        return self._params.get('rnn_core', 'static') == 'dynamic'
+
+    def should_use_lstm_peephole(self):
+        """
+        """
+        return self._params['rnn_cell'] == 'lstm' and \
+            self._params['lstm_use_peephole']
+
+    def should_use_numpy_engine(self):
+        """
+        """
+        return self._params.get('detect_engine', 'tensorflow') == 'numpy'
+
+    def should_sync_replicas(self):
+        """
+        aggregate gradients of all workers of parallel_train.py per step.
+        """
+        return self._params.get('parallel_sync', True)
+
+    def should_evaluate_in_training(self):
+        """
+        evaluate the test split after each epoch of train.py.
+        """
+        return self._params.get('evaluate_in_training', True)
+
+    def should_stream_detection(self):
+        """
+        """
+        return self._params.get('detect_stream', False)
+
     def should_add_bias_before_rnn(self):
         """
         """
@@ -1,7 +1,9 @@
 """
 """
 import hashlib
+import multiprocessing
 import os
+import time
 import numpy as np
 import scipy.io.wavfile as wav
 
@@ -16,13 +18,17 @@ class Arguments(object):
         if not os.path.isdir(path):
             os.makedirs(path)
 
-    def __init__(self, sample_rate=4000):
+    def __init__(self, sample_rate=4000, seed=0, worker_count=None):
         """
+        seed: base random seed of mixing.
+        worker_count: number of worker processes. use all cores if it's None.
         """
         self._voices = ["Alex", "Daniel", "Fiona", "Fred", "Karen", "Samantha",
                         "Tessa", "Victoria"]
 
         self._sample_rate = sample_rate
+        self._seed = seed
+        self._worker_count = worker_count or multiprocessing.cpu_count()
 
         rate_name = str(self._sample_rate)
 
@@ -124,6 +130,54 @@ def is_name_for_validate(name):
     return name[0] == 'b'
 
 
+def run_command(job):
+    """
+    run a shell command. remove its output if it fails, so the skip logic
+    retries it in next run.
+
+    job: (command, target_path)
+    """
+    command, target_path = job
+
+    code = os.system(command)
+
+    if code != 0 and os.path.isfile(target_path):
+        os.remove(target_path)
+
+    return job, code
+
+
+def run_commands(args, stage, jobs):
+    """
+    run (command, target_path) jobs on a process pool. report failures and
+    throughput. return the failed jobs with their exit status.
+    """
+    failures = []
+
+    time_begin = time.time()
+
+    if len(jobs) > 0:
+        pool = multiprocessing.Pool(args._worker_count)
+
+        try:
+            for job, code in pool.imap_unordered(run_command, jobs):
+                if code != 0:
+                    failures.append((job, code))
+        finally:
+            pool.close()
+            pool.join()
+
+    time_spent = max(time.time() - time_begin, 1e-6)
+
+    for (command, _), code in failures:
+        print 'failed ({}): {}'.format(code, command)
+
+    print '{}: {} jobs, {} failed, {:.1f} seconds, {:.2f} jobs/second'.format(
+        stage, len(jobs), len(failures), time_spent, len(jobs) / time_spent)
+
+    return failures
+
+
 def arrange_sentences(args):
     """
     """
@@ -167,6 +221,8 @@ def speak(args):
 
         sentences.append(f)
 
+    jobs = []
+
     for sentence in sentences:
         name = sentence[:-4]
 
@@ -186,7 +242,9 @@ def speak(args):
             command_say = "/usr/bin/say -v {} -f {} -o {}".format(
                     voice, source_path, target_path)
 
-            os.system(command_say)
+            jobs.append((command_say, target_path))
+
+    run_commands(args, 'speaking', jobs)
 
 
 def resample_voices(args):
@@ -196,6 +254,8 @@ def resample_voices(args):
 
     print 'resampling voices'
 
+    jobs = []
+
     for caf in os.listdir(source_dir):
         if not os.path.isfile(os.path.join(source_dir, caf)):
             continue
@@ -218,10 +278,12 @@ def resample_voices(args):
         if os.path.isfile(target_path):
             continue
 
-        command = "ffmpeg -i {} -acodec pcm_f32le -ac 1 -ar {} {}" \
+        command = "ffmpeg -nostdin -i {} -acodec pcm_f32le -ac 1 -ar {} {}" \
             .format(source_path, args._sample_rate, target_path)
 
-        os.system(command)
+        jobs.append((command, target_path))
+
+    run_commands(args, 'resampling voices', jobs)
 
 
 def resample_bg(args):
@@ -231,6 +293,8 @@ def resample_bg(args):
 
     source_dir = args._dir_bground_raw
 
+    jobs = []
+
     for mp3 in os.listdir(source_dir):
         if not os.path.isfile(os.path.join(source_dir, mp3)):
             continue
@@ -253,10 +317,85 @@ def resample_bg(args):
         if os.path.isfile(target_path):
             continue
 
-        command = "ffmpeg -i {} -acodec pcm_f32le -ac 1 -ar {} {}" \
+        command = "ffmpeg -nostdin -i {} -acodec pcm_f32le -ac 1 -ar {} {}" \
             .format(source_path, args._sample_rate, target_path)
 
-        os.system(command)
+        jobs.append((command, target_path))
+
+    run_commands(args, 're-sampling background sound', jobs)
+
+
+def mix_seed(seed, sound_dir, bgm_name):
+    """
+    random seed of a background track. depends only on the base seed and the
+    track, so a track is mixed the same way whatever order it's processed in.
+    """
+    key = '{}:{}'.format(seed, os.path.join(sound_dir, bgm_name))
+
+    return int(hashlib.md5(key).hexdigest()[:8], 16)
+
+
+def mix_track(job):
+    """
+    mix voices into one background track and write the wav/srt pair.
+
+    job: (sample_rate, seed, sound_dir, voice_dir, movie_dir, bgm_name,
+          wav_names)
+    """
+    sample_rate, seed, sound_dir, voice_dir, movie_dir, bgm_name, wav_names = \
+        job
+
+    rng = np.random.RandomState(seed)
+
+    _, bgm = wav.read(os.path.join(sound_dir, bgm_name))
+
+    # newer scipy returns read-only buffers
+    bgm = np.array(bgm)
+
+    index = 0
+    timestamps = []
+
+    wav_name_indice = rng.choice(
+        len(wav_names), [len(wav_names)], replace=False)
+
+    for wav_name_index in wav_name_indice:
+        wav_name = wav_names[wav_name_index]
+
+        _, tmp = wav.read(os.path.join(voice_dir, wav_name))
+
+        if index + len(tmp) >= len(bgm):
+            break
+
+        factor = 0.5 * rng.random_sample()
+
+        span = slice(index, index + len(tmp))
+
+        bgm[span] = bgm[span] * factor + tmp
+
+        timestamps.append((index, len(tmp)))
+
+        index += 2 * len(tmp)
+
+    mov_name = hashlib.md5(bgm).hexdigest()
+
+    target_wav = os.path.join(movie_dir, mov_name + '.wav')
+    target_srt = os.path.join(movie_dir, mov_name + '.srt')
+
+    wav.write(target_wav, sample_rate, bgm)
+
+    # srt
+    with open(target_srt, 'w') as srt:
+        for x in xrange(len(timestamps)):
+            time_head = timestamps[x][0]
+            time_tail = timestamps[x][1] + time_head
+            time_head = make_timestamp(time_head, sample_rate)
+            time_tail = make_timestamp(time_tail, sample_rate)
+
+            srt.write("{}\n".format(x))
+            srt.write("{} --> {}\n".format(time_head, time_tail))
+            srt.write("!@#$%^\n\n")
+
+    return bgm_name, len(timestamps)
 
 
 def mix(args):
@@ -274,58 +413,30 @@ def mix(args):
     categories[2].append(args._dir_voice_target_test)
     categories[2].append(args._dir_cue_target_test)
 
+    jobs = []
+
     for category in categories:
         sound_dir, voice_dir, movie_dir = category
 
         bgm_names = collect_file_names(sound_dir, 'wav')
-        wav_names = collect_file_names(voice_dir, 'wav')
+        wav_names = sorted(collect_file_names(voice_dir, 'wav'))
 
         print 'mix category: {}'.format(sound_dir)
 
         for bgm_name in bgm_names:
-            _, bgm = wav.read(os.path.join(sound_dir, bgm_name))
-
-            index = 0
-            timestamps = []
-
-            wav_name_indice = np.random.choice(
-                len(wav_names), [len(wav_names)], replace=False)
-
-            for wav_name_index in wav_name_indice:
-                wav_name = wav_names[wav_name_index]
-
-                _, tmp = wav.read(os.path.join(voice_dir, wav_name))
-
-                if index + len(tmp) >= len(bgm):
-                    break
-
-                factor = 0.5 * np.random.random()
-
-                for x in xrange(len(tmp)):
-                    bgm[index + x] = bgm[index + x] * factor + tmp[x]
-
-                timestamps.append((index, len(tmp)))
-
-                index += 2 * len(tmp)
-
-            mov_name = hashlib.md5(bgm).hexdigest()
-
-            target_wav = os.path.join(movie_dir, mov_name + '.wav')
-            target_srt = os.path.join(movie_dir, mov_name + '.srt')
+            seed = mix_seed(args._seed, sound_dir, bgm_name)
 
-            wav.write(target_wav, args._sample_rate, bgm)
+            jobs.append((args._sample_rate, seed, sound_dir, voice_dir,
+                         movie_dir, bgm_name, wav_names))
 
-            # srt
-            with open(target_srt, 'w') as srt:
-                for x in xrange(len(timestamps)):
-                    time_head = timestamps[x][0]
-                    time_tail = timestamps[x][1] + time_head
-                    time_head = make_timestamp(time_head, args._sample_rate)
-                    time_tail = make_timestamp(time_tail, args._sample_rate)
+    pool = multiprocessing.Pool(args._worker_count)
 
-                    srt.write("{}\n".format(x))
-                    srt.write("{} --> {}\n".format(time_head, time_tail))
-                    srt.write("!@#$%^\n\n")
+    try:
+        for bgm_name, voice_count in pool.imap_unordered(mix_track, jobs):
+            print 'mixed {} voices into {}'.format(voice_count, bgm_name)
+    finally:
+        pool.close()
+        pool.join()
 
 
 if __name__ == "__main__":
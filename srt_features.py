@@ -1,5 +1,7 @@
 """
 """
+import collections
+import os
 import numpy as np
 
 
@@ -46,10 +48,21 @@ class SrtCue(object):
 class SrtFeatures(object):
     """
     """
+    # labels of loaded files, shared by all instances in the process. least
+    # recently used entries are dropped beyond _labels_cache_size.
+    # key: (path, mtime, sample_rate, window_size, window_step)
+    _labels_cache = collections.OrderedDict()
+    _labels_cache_size = 1024
+
     def __init__(self):
         """
         """
         self._cues = []
+        self._path = None
+        self._mtime = None
+        self._sample_rate = None
+        self._heads = None
+        self._tails = None
 
     def cues(self):
         """
@@ -60,6 +73,9 @@ class SrtFeatures(object):
     def load(self, path, sample_rate):
         """
         """
+        # before reading, a later change gets a new key
+        mtime = os.path.getmtime(path)
+
         lines = []
 
         for line in open(path):
@@ -76,39 +92,119 @@ class SrtFeatures(object):
         if len(lines) > 0:
             self._cues.append(SrtCue(lines, sample_rate))
 
-    def features(self, begin, end, window_size, window_step):
+        self._path = path
+        self._mtime = mtime
+        self._sample_rate = sample_rate
+        self._heads = None
+        self._tails = None
+
+    def timestamps(self):
         """
+        head and tail timestamps of valid cues in file order.
         """
-        source_len = len(self._cues)
-        target_len = end - begin
+        if self._heads is None:
+            cues = [c for c in self._cues if c._head_timestamp is not None]
+
+            self._heads = np.array(
+                [c._head_timestamp for c in cues], dtype=np.int64)
+            self._tails = np.array(
+                [c._tail_timestamp for c in cues], dtype=np.int64)
+
+        return self._heads, self._tails
+
+    @staticmethod
+    def mask(heads, tails, begin, end, window_size, window_step):
+        """
+        frame t in [begin, end) covers [window_step * t,
+        window_step * t + window_size). it's 1 if the first cue which has not
+        ended before the frame begins (in cue order) begins before the frame
+        ends.
+
+        heads, tails:
+            timestamps of cues.
+        """
+        result = np.zeros([end - begin], dtype=np.int32)
+
+        if len(heads) == 0 or end <= begin:
+            return result
+
+        target_b = window_step * np.arange(begin, end, dtype=np.int64)
+        target_e = target_b + window_size
+
+        # a cue is passed once a frame begins after its tail, and frames only
+        # move forward, so the current cue is the first one whose running max
+        # tail is beyond the frame head.
+        indices = np.searchsorted(
+            np.maximum.accumulate(tails), target_b, side='right')
+
+        valid = indices < len(heads)
+
+        result[valid] = heads[indices[valid]] < target_e[valid]
+
+        return result
+
+    def labels(self, window_size, window_step):
+        """
+        masks from frame 0 to the last frame which may overlap a cue. frames
+        after it are all 0. cached per file (and its mtime) and window
+        parameters.
+        """
+        cache = SrtFeatures._labels_cache
+
+        key = (self._path, self._mtime, self._sample_rate, window_size,
+               window_step)
+
+        if self._path is not None and key in cache:
+            # most recently used last
+            result = cache.pop(key)
+
+            cache[key] = result
+
+            return result
 
-        source_idx = 0
-        target_idx = 0
+        heads, tails = self.timestamps()
 
-        result = np.zeros([target_len], dtype=np.int32)
+        if len(tails) == 0:
+            size = 0
+        else:
+            size = max(0, -(-int(tails.max()) // window_step))
 
-        while source_idx < source_len and target_idx < target_len:
-            target_b = window_step * (begin + target_idx)
-            target_e = window_size + target_b
+        result = SrtFeatures.mask(heads, tails, 0, size, window_size,
+                                  window_step)
 
-            cue = self._cues[source_idx]
+        if self._path is not None:
+            cache[key] = result
 
-            if cue._tail_timestamp <= target_b:
-                source_idx += 1
-                continue
+            while len(cache) > SrtFeatures._labels_cache_size:
+                cache.popitem(last=False)
 
-            if cue._head_timestamp >= target_e:
-                target_idx += 1
-                continue
+        return result
 
-            result[target_idx] = 1
+    def features(self, begin, end, window_size, window_step):
+        """
+        """
+        result = np.zeros([end - begin], dtype=np.int32)
 
-            target_idx += 1
+        labels = self.labels(window_size, window_step)
+
+        size = min(end, len(labels)) - begin
+
+        if size > 0:
+            result[:size] = labels[begin:begin + size]
 
         return result
 
 
 class SrtWriter(object):
+    @staticmethod
+    def segments(features):
+        """
+        [head, tail) frame indices of runs of 1 in the masks.
+        """
+        features = np.hstack(([False], np.asarray(features) == 1, [False]))
+
+        return np.flatnonzero(np.diff(features)).reshape(-1, 2)
+
     @staticmethod
     def timestamp(idx, step, sample_rate):
         """
@@ -122,39 +218,174 @@ class SrtWriter(object):
         return "{}:{}:{},{}".format(H, M, S, m)
 
     @staticmethod
-    def save(path, features, sample_rate, window_step):
+    def merge(segments, min_segment_size=0, min_gap_size=0):
+        """
+        join segments separated by less than min_gap_size frames, then drop
+        segments shorter than min_segment_size frames.
+        """
+        heads, tails = segments[:, 0], segments[:, 1]
+
+        if min_gap_size > 0 and len(heads) > 1:
+            # a segment starts a new cue only if the gap before it is large
+            opens = np.hstack(([True], heads[1:] - tails[:-1] >= min_gap_size))
+            closes = np.hstack((opens[1:], [True]))
+
+            heads, tails = heads[opens], tails[closes]
+
+        if min_segment_size > 0:
+            keeps = tails - heads >= min_segment_size
+
+            heads, tails = heads[keeps], tails[keeps]
+
+        return np.vstack((heads, tails)).T.reshape(-1, 2)
+
+    @staticmethod
+    def timestamps(indices, step, sample_rate):
+        """
+        same as timestamp for an array of frame indices.
+        """
+        t = np.asarray(indices, dtype=np.int64) * step * 1000 // sample_rate
+
+        H, t = t // 3600000, t % 3600000
+        M, t = t // 60000, t % 60000
+        S, m = t // 1000, t % 1000
+
+        hmsm = zip(H.tolist(), M.tolist(), S.tolist(), m.tolist())
+
+        return ["{}:{}:{},{}".format(*x) for x in hmsm]
+
+    @staticmethod
+    def cues(segments, sample_rate, window_step, caption_idx=0):
+        """
+        srt text of segments, numbered from caption_idx.
+        """
+        times = SrtWriter.timestamps(
+            segments.ravel(), window_step, sample_rate)
+
+        return ''.join(
+            "{}\n{} --> {}\n!@#$%^\n\n".format(
+                caption_idx + idx, times[2 * idx], times[2 * idx + 1])
+            for idx in xrange(len(segments)))
+
+    @staticmethod
+    def save(path, features, sample_rate, window_step, min_segment_size=0,
+             min_gap_size=0):
         """
         """
+        segments = SrtWriter.merge(
+            SrtWriter.segments(features), min_segment_size, min_gap_size)
+
         with open(path, 'w') as srt:
-            caption_idx = 0
-            feature_idx = 0
-
-            while True:
-                while True:
-                    if feature_idx >= len(features):
-                        break
-                    if features[feature_idx] == 1:
-                        break
-                    feature_idx += 1
-
-                if feature_idx >= len(features):
-                    break
-
-                time_head = \
-                    SrtWriter.timestamp(feature_idx, window_step, sample_rate)
-
-                while True:
-                    if feature_idx >= len(features):
-                        break
-                    if features[feature_idx] == 0:
-                        break
-                    feature_idx += 1
-
-                time_tail = \
-                    SrtWriter.timestamp(feature_idx, window_step, sample_rate)
-
-                srt.write("{}\n".format(caption_idx))
-                srt.write("{} --> {}\n".format(time_head, time_tail))
-                srt.write("!@#$%^\n\n")
-
-                caption_idx += 1
+            srt.write(SrtWriter.cues(segments, sample_rate, window_step))
+
+
+class SrtStreamWriter(object):
+    """
+    write srt while masks are still being detected. a cue is written as soon
+    as its segment closes, or with min_gap_size, as soon as the stream is
+    min_gap_size frames past it and no later segment can be merged into it.
+    the output equals SrtWriter.save on the concatenation of all masks.
+    """
+    def __init__(self, path, sample_rate, window_step, min_segment_size=0,
+                 min_gap_size=0):
+        """
+        """
+        self._srt = open(path, 'w')
+        self._sample_rate = sample_rate
+        self._window_step = window_step
+        self._min_segment_size = min_segment_size
+        self._min_gap_size = min_gap_size
+        self._caption_idx = 0
+        self._feature_idx = 0
+        self._head_idx = None
+        self._pending = None
+
+    def write_cue(self, head_idx, tail_idx):
+        """
+        """
+        if tail_idx - head_idx < self._min_segment_size:
+            return
+
+        self._srt.write(SrtWriter.cues(
+            np.array([[head_idx, tail_idx]]), self._sample_rate,
+            self._window_step, self._caption_idx))
+        self._srt.flush()
+
+        self._caption_idx += 1
+
+    def close_segment(self, head_idx, tail_idx):
+        """
+        merge a closed segment into the pending one if the gap between them
+        is small, otherwise write the pending one.
+        """
+        if self._min_gap_size <= 0:
+            self.write_cue(head_idx, tail_idx)
+            return
+
+        if self._pending is not None:
+            if head_idx - self._pending[1] < self._min_gap_size:
+                self._pending = (self._pending[0], tail_idx)
+                return
+
+            self.write_cue(*self._pending)
+
+        self._pending = (head_idx, tail_idx)
+
+    def write(self, features):
+        """
+        features: next masks of the stream.
+        """
+        features = np.asarray(features) == 1
+
+        # indices where masks switch between 0 and 1
+        last = self._head_idx is not None
+        edges = np.flatnonzero(np.diff(np.hstack(([last], features))))
+        edges += self._feature_idx
+
+        for idx in edges:
+            if self._head_idx is None:
+                self._head_idx = idx
+            else:
+                self.close_segment(self._head_idx, idx)
+
+                self._head_idx = None
+
+        self._feature_idx += len(features)
+
+        self.flush_pending()
+
+    def flush_pending(self):
+        """
+        write the pending segment once no segment can be merged into it,
+        i.e. the next segment can't begin before the end of the gap.
+        """
+        if self._pending is None:
+            return
+
+        gap_tail = self._pending[1] + self._min_gap_size
+
+        if self._head_idx is None:
+            ready = self._feature_idx >= gap_tail
+        else:
+            ready = self._head_idx >= gap_tail
+
+        if ready:
+            self.write_cue(*self._pending)
+
+            self._pending = None
+
+    def close(self):
+        """
+        close the open segment (if any) at the end of the stream.
+        """
+        if self._head_idx is not None:
+            self.close_segment(self._head_idx, self._feature_idx)
+
+            self._head_idx = None
+
+        if self._pending is not None:
+            self.write_cue(*self._pending)
+
+            self._pending = None
+
+        self._srt.close()
@@ -0,0 +1,102 @@
+"""
+wall time spent in each stage of the training pipeline.
+
+stages are timed with the process wide timer:
+
+    with stage_timer.stage('mfcc'):
+        ...
+
+batch workers pop their timings after each batch and send them with it, the
+loader merges them into the timer of the training process. times of stages
+which run in workers are summed over all workers.
+"""
+import contextlib
+import json
+import time
+
+
+class StageTimer(object):
+    """
+    """
+    def __init__(self):
+        """
+        """
+        self._seconds = {}
+        self._counts = {}
+
+    def add(self, name, seconds, count=1):
+        """
+        """
+        self._seconds[name] = self._seconds.get(name, 0.0) + seconds
+        self._counts[name] = self._counts.get(name, 0) + count
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        """
+        begin = time.time()
+
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - begin)
+
+    def merge(self, timings):
+        """
+        add timings popped from another timer.
+        """
+        for name, (seconds, count) in timings.items():
+            self.add(name, seconds, count)
+
+    def pop(self):
+        """
+        return {name: (seconds, count)} and reset.
+        """
+        timings = {name: (self._seconds[name], self._counts[name])
+                   for name in self._seconds}
+
+        self._seconds = {}
+        self._counts = {}
+
+        return timings
+
+
+class TimingLog(object):
+    """
+    json lines of per step stage times, one line per report.
+    """
+    def __init__(self, path):
+        """
+        """
+        self._path = path
+
+    def write(self, gstep, step_count, timings):
+        """
+        return {name: milliseconds per step}.
+        """
+        step_count = max(1, step_count)
+
+        ms = {name: 1000.0 * seconds / step_count
+              for name, (seconds, _) in timings.items()}
+
+        with open(self._path, 'a') as log:
+            log.write(json.dumps({
+                'time': time.time(),
+                'gstep': int(gstep),
+                'steps': step_count,
+                'ms_per_step': ms,
+                'calls': {name: count for name, (_, count) in timings.items()},
+            }, sort_keys=True) + '\n')
+
+        return ms
+
+
+# the timer of this process
+TIMER = StageTimer()
+
+
+def stage(name):
+    """
+    time a block in the timer of this process.
+    """
+    return TIMER.stage(name)
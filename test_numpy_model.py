@@ -0,0 +1,149 @@
+"""
+detection of NumpyVadModel split into chunks, states carried between calls.
+
+usage:
+    python -m unittest test_numpy_model
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from numpy_model import NumpyVadModel
+
+
+class TestParameters(object):
+    """
+    a small model, weights in weights_path.
+    """
+    def __init__(self, weights_path):
+        """
+        """
+        self._weights_path = weights_path
+
+    def get_numpy_weights_path(self):
+        return self._weights_path
+
+    def get_rnn_sequence_length(self):
+        return 20
+
+    def get_srt_delay_size(self):
+        return 5
+
+    def get_rnn_unit_num(self):
+        return 8
+
+    def get_lstm_forget_bias(self):
+        return 1.0
+
+    def should_use_lstm_peephole(self):
+        return True
+
+    def get_hidden_layer_dim_before_rnn(self):
+        return [16]
+
+    def get_hidden_layer_dim_after_rnn(self):
+        return [10]
+
+    def should_add_bias_before_rnn(self):
+        return True
+
+    def should_add_bias_after_rnn(self):
+        return True
+
+    def get_non_linear_gate_before_rnn(self):
+        return 'tanh'
+
+    def get_non_linear_gate_after_rnn(self):
+        return 'relu'
+
+    def should_add_residual_before_rnn(self):
+        return False
+
+    def should_add_residual_after_rnn(self):
+        return False
+
+    def get_cpu_affinity(self):
+        return None
+
+    def set_cpu_affinity(self, cpus):
+        pass
+
+
+class TestChunkedDetect(unittest.TestCase):
+    """
+    """
+    cepstrum_size = 13
+
+    def setUp(self):
+        """
+        random weights of TestParameters.
+        """
+        self._dir = tempfile.mkdtemp(prefix='vad_test_')
+
+        rng = np.random.RandomState(0)
+
+        def weights(*shape):
+            return rng.randn(*shape).astype(np.float32) * 0.5
+
+        units = 8
+
+        path = os.path.join(self._dir, 'model.npz')
+
+        np.savez(
+            path,
+            bw0=weights(self.cepstrum_size, 16), bb0=weights(16),
+            lstm_w=weights(16 + units, 4 * units), lstm_b=weights(4 * units),
+            lstm_wf=weights(units), lstm_wi=weights(units),
+            lstm_wo=weights(units),
+            aw0=weights(units, 10), ab0=weights(10),
+            aw1=weights(10, 2), ab1=weights(2))
+
+        self._model = NumpyVadModel(TestParameters(path))
+        self._wav = rng.randn(1, 200, self.cepstrum_size).astype(np.float32)
+
+    def tearDown(self):
+        """
+        """
+        shutil.rmtree(self._dir)
+
+    def test_detect(self):
+        """
+        two calls with the states of the first one equal one call.
+        """
+        model = self._model
+
+        whole, whole_states = model.detect(self._wav, return_states=True)
+
+        head, states = model.detect(self._wav[:, :80], return_states=True)
+        tail, states = model.detect(
+            self._wav[:, 80:], states, return_states=True)
+
+        np.testing.assert_array_equal(np.hstack([head, tail]), whole)
+
+        for state, whole_state in zip(states, whole_states):
+            np.testing.assert_allclose(state, whole_state, rtol=1e-6)
+
+    def test_detect_stream(self):
+        """
+        two streams with the states of the first one equal one call.
+        """
+        model = self._model
+        wav = self._wav[0]
+
+        whole = model.detect(self._wav)[0]
+
+        results = []
+
+        for masks, states in model.detect_stream(
+                [wav[:40], wav[40:100]], return_states=True):
+            results.append(masks)
+
+        results.extend(model.detect_stream([wav[100:]], states))
+
+        np.testing.assert_array_equal(np.hstack(results), whole)
+
+
+if __name__ == '__main__':
+    unittest.main()
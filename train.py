@@ -1,11 +1,15 @@
 """
 """
 import os
-import numpy as np
+import stage_timer
+from batch_loader import BatchLoader, load_batch
+from bucket_sampler import BucketSampler
+from corpus import Corpus
+from evaluate import evaluate, load_split
+from feature_store import FeatureStore
+from mix_source import MixSource
 from model import VadModel
 from parameters import Parameters
-from srt_features import SrtFeatures
-from wav_features import WavFeatures
 
 
 def collect_file_names(path_dir, extension):
@@ -25,61 +29,123 @@ def collect_file_names(path_dir, extension):
     return names
 
 
-def train(params, model, context):
+def make_batch_loader(params, seed_offset=0):
     """
-    """
-    data_dir_training = params.get_dir_cue_training()
-    data_wav_training = collect_file_names(data_dir_training, 'wav')
+    build a BatchLoader which samples training batches in background.
 
-    batch_size = params.get_batch_size()
-    sequence_size = params.get_rnn_sequence_length()
-    wav_window_size = params.get_wav_window_size()
-    wav_window_step = params.get_wav_window_step()
-    wav_sample_rate = params.get_wav_sample_rate()
+    seed_offset: added to the random seed, so replicas of parallel_train.py
+    draw different batches.
+    """
+    seed = params.get_random_seed()
 
-    wav_window_size_second = float(wav_window_size) / float(wav_sample_rate)
-    wav_window_step_second = float(wav_window_step) / float(wav_sample_rate)
+    if seed is not None:
+        seed += seed_offset
 
-    wav_batch = []
-    srt_batch = []
+    data_dir_training = params.get_dir_cue_training()
+    data_wav_training = collect_file_names(data_dir_training, 'wav')
 
-    for i in xrange(batch_size):
-        while True:
-            wav_index = np.random.randint(0, len(data_wav_training))
+    if params.should_use_corpus() or params.should_use_feature_store():
+        # sampling windows from memory is cheaper than passing batches
+        # between processes, build them in place.
+        if params.should_use_feature_store():
+            corpus = FeatureStore(
+                params, params.get_dir_store_training()).corpus()
+        else:
+            corpus = Corpus.load(params, data_dir_training, data_wav_training)
+
+        batch_size = params.get_batch_size()
+        window_size = params.get_corpus_window_size()
+
+        print 'loaded {} files, {} frames'.format(
+            corpus.file_count(), corpus.frame_size())
+
+        def make_batch(rng):
+            with stage_timer.stage('sample'):
+                return corpus.sample(rng, batch_size, window_size)
+
+        return BatchLoader(
+            make_batch, worker_count=0, seed=seed)
+
+    if params.should_use_mix_source():
+        # mfcc of fresh mixtures is expensive, build them in workers
+        mix_source = MixSource(
+            params,
+            params.get_dir_bground_training(),
+            params.get_dir_voice_training())
+
+        return BatchLoader(
+            mix_source.make_batch,
+            worker_count=params.get_loader_worker_count(),
+            queue_depth=params.get_loader_queue_depth(),
+            seed=seed)
+
+    if params.should_use_bucket_sampler():
+        sampler = BucketSampler(params, data_dir_training, data_wav_training)
+
+        for head, tail, count in sampler.bucket_sizes():
+            print 'bucket of {} files, {} to {} frames'.format(
+                count, head, tail)
+
+        make_batch = sampler.make_batch
+    else:
+        def make_batch(rng):
+            return load_batch(
+                params, data_dir_training, data_wav_training, rng)
+
+    return BatchLoader(
+        make_batch,
+        worker_count=params.get_loader_worker_count(),
+        queue_depth=params.get_loader_queue_depth(),
+        seed=seed)
+
+
+def train(params, model, context, loader):
+    """
+    """
+    trace_interval = params.get_trace_interval()
 
-            name, _ = os.path.splitext(data_wav_training[wav_index])
+    if trace_interval > 0 and \
+            context['gstep_trace'] + trace_interval < context['gstep_last']:
+        context['gstep_trace'] = context['gstep_last']
 
-            data_wav_path = os.path.join(data_dir_training, name + '.wav')
-            data_srt_path = os.path.join(data_dir_training, name + '.srt')
+        model.trace_next_run(params.get_trace_path(context['gstep_last']))
 
-            train_wav = WavFeatures()
-            train_srt = SrtFeatures()
+    wav_batch, srt_batch = loader.next_batch()
 
-            train_wav.load(
-                data_wav_path,
-                window_size=wav_window_size_second,
-                window_step=wav_window_step_second,
-                numcep=params.get_wav_cepstrum_size())
-            train_srt.load(data_srt_path, wav_sample_rate)
+    _, gstep, summaries, loss, accuracy, _ = model.train(wav_batch, srt_batch)
 
-            if train_wav.feature_size() > sequence_size:
-                break
+    context['gstep_last'] = gstep
+    context['timing_steps'] += 1
 
-        wav_features = train_wav.features()
-        srt_features = train_srt.features(
-            0, len(wav_features), wav_window_size, wav_window_step)
+    # frames which survive the truncation of reshape_data
+    sequence_size = params.get_rnn_sequence_length()
+    lengths = [len(wav) for wav in wav_batch]
 
-        wav_batch.append(wav_features)
-        srt_batch.append(srt_features)
+    context['frames_used'] += \
+        len(lengths) * (min(lengths) / sequence_size) * sequence_size
+    context['frames_loaded'] += sum(lengths)
 
-    _, gstep, summaries, loss, accuracy, _ = model.train(wav_batch, srt_batch)
+    # only the chief of parallel_train.py reports and saves
+    if not model.is_chief():
+        return gstep
 
     if context['gstep'] + 100 < gstep:
         context['gstep'] = gstep
 
         model.save_summary(gstep, summary=summaries)
 
-        print "step:{}, loss: {}, accuracy: {}".format(gstep, loss, accuracy)
+        report_timings(params, model, context, gstep)
+
+        utilization = float(context['frames_used']) / \
+            max(1, context['frames_loaded'])
+
+        context['frames_used'] = 0
+        context['frames_loaded'] = 0
+
+        model.save_summary(gstep, 'frame utilization', utilization)
+
+        print "step:{}, loss: {}, accuracy: {}, frame utilization: {}".format(
+            gstep, loss, accuracy, utilization)
 
     if context['gstep_checkpoint'] + 10000 < gstep:
         context['gstep_checkpoint'] = gstep
@@ -91,69 +157,67 @@ def train(params, model, context):
     return gstep
 
 
-def test(params, model, context):
+def report_timings(params, model, context, gstep):
     """
+    write milliseconds per step of each stage since the last report to
+    tensorboard and the timing log.
     """
-    data_dir_test = params.get_dir_cue_test()
-    data_wav_test = collect_file_names(data_dir_test, 'wav')
-
-    wav_window_size = params.get_wav_window_size()
-    wav_window_step = params.get_wav_window_step()
-    wav_sample_rate = params.get_wav_sample_rate()
+    timings = stage_timer.TIMER.pop()
 
-    wav_window_size_second = float(wav_window_size) / float(wav_sample_rate)
-    wav_window_step_second = float(wav_window_step) / float(wav_sample_rate)
+    ms = context['timing_log'].write(gstep, context['timing_steps'], timings)
 
-    wav_batch = []
-    srt_batch = []
+    context['timing_steps'] = 0
 
-    wav_index = np.random.randint(0, len(data_wav_test))
+    for name in sorted(ms):
+        model.save_summary(gstep, 'time/{}'.format(name), ms[name])
 
-    name, _ = os.path.splitext(data_wav_test[wav_index])
+    print 'ms per step: {}'.format(', '.join(
+        '{}: {:.1f}'.format(name, ms[name]) for name in sorted(ms)))
 
-    data_wav_path = os.path.join(data_dir_test, name + '.wav')
-    data_srt_path = os.path.join(data_dir_test, name + '.srt')
 
-    train_wav = WavFeatures()
-    train_srt = SrtFeatures()
-
-    train_wav.load(
-        data_wav_path,
-        window_size=wav_window_size_second,
-        window_step=wav_window_step_second,
-        numcep=params.get_wav_cepstrum_size())
-    train_srt.load(data_srt_path, wav_sample_rate)
+def test(params, model, context, samples):
+    """
+    evaluate all files of the test split.
 
-    wav_features = train_wav.features()
-    srt_features = train_srt.features(
-        0, len(wav_features), wav_window_size, wav_window_step)
+    samples: features and labels of the test split, from evaluate.load_split.
+    """
+    gstep = model.global_step()
 
-    wav_batch.append(wav_features)
-    srt_batch.append(srt_features)
+    report = evaluate(params, model, samples)
 
-    gstep, accuracy = model.test(wav_batch, srt_batch)
+    model.save_summary(gstep, "test accuracy", report['accuracy'])
 
-    model.save_summary(gstep, "test accuracy", accuracy)
+    for key in ['precision', 'recall', 'f1', 'segment_precision',
+                'segment_recall', 'segment_f1']:
+        model.save_summary(gstep, 'test/{}'.format(key), report[key])
 
-    print 'step:{}, test accuracy: {}'.format(gstep, accuracy)
+    print 'step:{}, test accuracy: {}, f1: {}, segment f1: {}'.format(
+        gstep, report['accuracy'], report['f1'], report['segment_f1'])
 
 
-def learn(params, model):
+def learn(params, model, loader, test_samples):
     """
     """
     context = {
         'gstep': 0,
         'gstep_checkpoint': 0,
+        'gstep_trace': 0,
+        'gstep_last': 0,
+        'timing_steps': 0,
+        'frames_used': 0,
+        'frames_loaded': 0,
+        'timing_log': stage_timer.TimingLog(params.get_timing_log_path()),
     }
 
     for epoch in xrange(params.get_epoch_count()):
         for step in xrange(params.get_epoch_size()):
-            gstep = train(params, model, context)
+            gstep = train(params, model, context, loader)
 
-            if gstep >= params.get_max_steps():
+            if gstep >= params.get_max_steps() or model.should_stop():
                 return
 
-        test(params, model, context)
+        if test_samples is not None:
+            test(params, model, context, test_samples)
 
 
 if __name__ == "__main__":
@@ -161,9 +225,23 @@ if __name__ == "__main__":
     """
     params = Parameters()
 
+    # evaluate.py may score checkpoints in another process instead
+    if params.should_evaluate_in_training():
+        test_samples = load_split(
+            params, params.get_dir_cue_test(),
+            params.get_evaluate_worker_count())
+    else:
+        test_samples = None
+
+    # fork loader workers before tensorflow starts its threads
+    loader = make_batch_loader(params)
+    loader.start()
+
     model = VadModel(params)
 
     try:
-        learn(params, model)
+        learn(params, model, loader, test_samples)
     except KeyboardInterrupt:
         pass
+    finally:
+        loader.close()
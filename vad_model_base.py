@@ -0,0 +1,149 @@
+"""
+"""
+import numpy as np
+
+
+class VadModelBase(object):
+    """
+    batch layout and batched detection shared by VadModel and
+    NumpyVadModel. subclasses set _training_sequence_size and
+    _srt_delay_size and implement zero_states and forward.
+
+    detection may be split into many calls: pass the last states of a call
+    (return_states=True) as the states of the next one. masks of the delay
+    are dropped only at the head of a stream, i.e. if states is None, so the
+    concatenation of the masks of all calls equals one call on the whole
+    stream.
+    """
+    def reshape_data(self, source, uni_length=None):
+        """
+        source:
+            the out-most container may be a list
+            shape: [batch_size, ?, feature_size]
+        uni_length:
+            desired length. find minimum length if it's None.
+
+        return:
+            shape: [batch_size, k * sequence_size, feature_size]
+        """
+        if uni_length is None:
+            sequence_size = self._training_sequence_size
+
+            min_length = min([r.shape[0] for r in source])
+
+            uni_length = (min_length / sequence_size) * sequence_size
+
+        return np.vstack([r[None, :uni_length] for r in source])
+
+    def pad_data(self, source):
+        """
+        source:
+            the out-most container may be a list
+            shape: [batch_size, ?, feature_size]
+
+        each stream is cut to a multiple of sequence_size (as reshape_data
+        does to a single stream), then zero padded to the longest one.
+        padding is at the tails, so it never affects valid frames.
+
+        return:
+            shape: [batch_size, k * sequence_size, feature_size]
+            lengths of streams
+        """
+        sequence_size = self._training_sequence_size
+
+        lengths = [(r.shape[0] / sequence_size) * sequence_size
+                   for r in source]
+
+        result = np.zeros(
+            (len(source), max(lengths), source[0].shape[1]), dtype=np.float32)
+
+        for idx, r in enumerate(source):
+            result[idx, :lengths[idx]] = r[:lengths[idx]]
+
+        return result, lengths
+
+    def detect_batch(self, source_wav):
+        """
+        source_wav:
+            wav features of streams with different lengths.
+            shape: [batch_size, ?, feature_size]
+
+        return:
+            masks of each stream, same as detect() on that stream alone.
+        """
+        source_wav, lengths = self.pad_data(source_wav)
+
+        if source_wav.shape[1] == 0:
+            return [np.zeros((0), dtype=np.int64) for _ in lengths]
+
+        results = self.detect(source_wav)
+
+        return [results[i, :max(0, lengths[i] - self._srt_delay_size)]
+                for i in xrange(len(lengths))]
+
+    def detect(self, source_wav, states=None, return_states=False):
+        """
+        source_wav:
+            shape: [batch_size, ?, feature_size]
+        states:
+            last states of the streams which source_wav continues. None for
+            the heads of streams.
+
+        return:
+            masks, shape: [batch_size, ?]
+            last states, if return_states
+        """
+        source_wav = self.reshape_data(source_wav)
+
+        if states is None:
+            skip_size = self._srt_delay_size
+            states = self.zero_states(source_wav.shape[0])
+        else:
+            skip_size = 0
+
+        results, states = self.forward(source_wav, states)
+
+        results = results[:, skip_size:]
+
+        return (results, states) if return_states else results
+
+    def detect_stream(self, source_blocks, states=None, return_states=False):
+        """
+        source_blocks:
+            iterable of wav features of one stream.
+            shape: [frame_size, feature_size]
+            frame_size of all blocks except the last one must be multiple of
+            sequence_size.
+        states:
+            last states of the stream which source_blocks continue. None for
+            the head of a stream.
+
+        a generator to yield masks block by block, with the states after the
+        block if return_states. states are carried over blocks, so the
+        concatenation of all masks equals detect() on the whole stream.
+        """
+        sequence_size = self._training_sequence_size
+
+        if states is None:
+            skip_size = self._srt_delay_size
+            states = self.zero_states(1)
+        else:
+            skip_size = 0
+
+        for source_wav in source_blocks:
+            total_size = (len(source_wav) / sequence_size) * sequence_size
+
+            if total_size == 0:
+                continue
+
+            results, states = self.forward(
+                source_wav[None, :total_size], states)
+
+            results = results[0]
+
+            # drop masks of the delay at the head of the stream
+            if skip_size > 0:
+                results, skip_size = \
+                    results[skip_size:], max(0, skip_size - len(results))
+
+            yield (results, states) if return_states else results
@@ -1,9 +1,14 @@
 """
 """
+import hashlib
+import os
 import numpy as np
 import scipy.io.wavfile as wav
 
 from python_speech_features import mfcc
+from python_speech_features.sigproc import round_half_up
+
+import stage_timer
 
 
 class WavFeatures(object):
@@ -17,24 +22,145 @@ class WavFeatures(object):
         self._window_size = None
         self._window_step = None
 
-    def load(self, path, window_size=0.025, window_step=0.01, numcep=13):
+    @staticmethod
+    def cache_path(cache_dir, path, sample_rate, window_size, window_step,
+                   numcep):
+        """
+        path of the cached features of a wav. the key is the md5 of the real
+        path, size and modification time of the wav plus all parameters which
+        affect the features. only the file is stat'ed, the content is not
+        read, and a rewritten wav gets a new key.
+        """
+        stat = os.stat(path)
+
+        digest = hashlib.md5('{}:{}:{!r}'.format(
+            os.path.realpath(path), stat.st_size, stat.st_mtime))
+
+        name = '{}_{}_{}_{}_{}.npy'.format(
+            digest.hexdigest(), sample_rate, window_size, window_step, numcep)
+
+        return os.path.join(cache_dir, name[:2], name)
+
+    def load(self, path, window_size=0.025, window_step=0.01, numcep=13,
+             cache_dir=None):
         """
+        cache_dir:
+            load features from the cache under cache_dir if there is one, or
+            compute and save them there. no cache if it's None.
         """
         self._window_size = window_size
         self._window_step = window_step
 
-        self._sample_rate, self._features = wav.read(path)
+        if cache_dir is not None:
+            # header only, samples are not read
+            self._sample_rate, _ = wav.read(path, mmap=True)
+
+            target_path = WavFeatures.cache_path(
+                cache_dir, path, self._sample_rate, window_size, window_step,
+                numcep)
+
+            if os.path.isfile(target_path):
+                with stage_timer.stage('cache_read'):
+                    self._features = np.load(target_path)
+
+                return
 
-        if len(self._features.shape) > 1:
-            self._features = self._features[:, 0]
+        with stage_timer.stage('wav_read'):
+            sample_rate, samples = wav.read(path)
+
+        with stage_timer.stage('mfcc'):
+            self.load_samples(
+                samples, sample_rate, window_size, window_step, numcep)
+
+        if cache_dir is not None:
+            target_dir = os.path.dirname(target_path)
+
+            if not os.path.isdir(target_dir):
+                try:
+                    os.makedirs(target_dir)
+                except OSError:
+                    # created by another process
+                    pass
+
+            # write then rename, readers never see a partial file
+            temp_path = '{}.{}.tmp'.format(target_path, os.getpid())
+
+            with open(temp_path, 'wb') as target:
+                np.save(target, self._features)
+
+            os.rename(temp_path, target_path)
+
+    def load_samples(self, samples, sample_rate, window_size=0.025,
+                     window_step=0.01, numcep=13):
+        """
+        compute features of samples in memory.
+        """
+        self._window_size = window_size
+        self._window_step = window_step
+        self._sample_rate = sample_rate
+
+        if len(samples.shape) > 1:
+            samples = samples[:, 0]
 
         self._features = mfcc(
-            self._features,
-            self._sample_rate,
+            samples,
+            sample_rate,
             winlen=window_size,
             winstep=window_step,
             numcep=numcep)
 
+    def stream(self, path, block_size, window_size=0.025, window_step=0.01,
+               numcep=13, preemph=0.97):
+        """
+        a generator to yield features of the wav block by block. samples are
+        memory mapped, only samples of the current block are touched. the
+        concatenation of all blocks equals the features of load().
+
+        block_size:
+            number of frames per block. the last block may be shorter.
+        """
+        self._window_size = window_size
+        self._window_step = window_step
+
+        self._sample_rate, samples = wav.read(path, mmap=True)
+
+        if len(samples.shape) > 1:
+            samples = samples[:, 0]
+
+        frame_size = round_half_up(window_size * self._sample_rate)
+        frame_step = round_half_up(window_step * self._sample_rate)
+
+        # same frame count as python_speech_features.sigproc.framesig
+        if len(samples) <= frame_size:
+            frame_count = 1
+        else:
+            frame_count = 1 + int(np.ceil(
+                float(len(samples) - frame_size) / float(frame_step)))
+
+        for frame_head in xrange(0, frame_count, block_size):
+            frame_tail = min(frame_head + block_size, frame_count)
+
+            sample_head = frame_head * frame_step
+            sample_tail = min(
+                (frame_tail - 1) * frame_step + frame_size, len(samples))
+
+            # pre-emphasis here with the sample before this block, so the
+            # result does not depend on where blocks are cut.
+            block = np.array(samples[max(sample_head - 1, 0):sample_tail])
+
+            if sample_head > 0:
+                block = block[1:] - preemph * block[:-1]
+            else:
+                block = np.append(block[0], block[1:] - preemph * block[:-1])
+
+            yield mfcc(
+                block,
+                self._sample_rate,
+                winlen=window_size,
+                winstep=window_step,
+                numcep=numcep,
+                preemph=0)
+
     def feature_shape(self):
         """
         """